@@ -2,80 +2,115 @@ import streamlit as st
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
-import datetime
 import os
-import gspread
 import json
 import numpy as np
-from google.oauth2.service_account import Credentials
 from openai import OpenAI
-from sklearn.cluster import KMeans
+from lrad.embedding_client import EmbeddingClient, EmbeddingError
+from lrad.log_sink import STAGE_COLUMNS
+from lrad.log_store import ChatLogStore
+from lrad.query_cache import QueryEmbeddingCache
+from lrad.sheet_export import SheetExporter
+from lrad.question_clusters import ClusterCache
+
+@st.cache_resource
+def get_embedding_client():
+    return EmbeddingClient(client=OpenAI(api_key=st.secrets.OpenAIAPI.openai_api_key))
+
+# 質問ごとの埋め込みはディスクに保存して再利用する
+@st.cache_resource
+def get_question_embeddings():
+    client = get_embedding_client()
+    return QueryEmbeddingCache(
+        client.embed_one, model=client.model, path=".lrad_cache/question_embeddings.sqlite3", ttl=365 * 24 * 3600
+    )
+
+STAGE_LABELS = {
+    "queue_ms": "API順番待ち",
+    "embedding_ms": "埋め込み",
+    "retrieval_ms": "FAQ検索",
+    "ttft_ms": "最初のトークンまで",
+    "generation_ms": "回答生成",
+    "total_ms": "合計",
+}
+ROUTE_LABELS = {
+    "exact": "完全一致",
+    "fast_path": "FAQ回答をそのまま返答",
+    "answer_cache": "回答キャッシュ",
+    "generated": "AI生成",
+    "no_match": "該当FAQなし",
+    "error": "エラー",
+    "busy": "混雑のため受付不可",
+}
+
+# Google Sheets への接続は保存ボタンを押したときに作り、以降は使い回す
+@st.cache_resource
+def get_insight_spreadsheet():
+    import gspread
+    from google.oauth2.service_account import Credentials
+
+    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+    raw_info = st.secrets["GoogleSheets"]["service_account_info"]
+    if isinstance(raw_info, str):
+        info = json.loads(raw_info)
+    else:
+        info = raw_info
+    creds = Credentials.from_service_account_info(info, scopes=scope)
+    gc = gspread.authorize(creds)
+    return gc.open_by_key(st.secrets["GoogleSheets"]["sheet_key"])
+
+# クラスタリングは表示期間ごとに保持し、新しい質問だけで更新する
+@st.cache_resource
+def get_cluster_cache():
+    return ClusterCache()
+
+# チャットログは月別Parquetに差分で取り込み、期間に該当する月だけを読む
+@st.cache_resource
+def get_log_store():
+    return ChatLogStore()
+
+@st.cache_data(max_entries=16)
+def load_logs(start_date, end_date, version):
+    df = get_log_store().load(start_date, end_date)
+    df["date"] = df["timestamp"].dt.date
+    df["hour"] = df["timestamp"].dt.hour
+    df["month"] = df["timestamp"].dt.to_period("M").astype(str)
+    return df
+
+@st.cache_data(max_entries=16)
+def load_rollup(start_date, end_date, version):
+    return get_log_store().rollup(start_date, end_date)
 
 def show_insights():
     st.title("📊 LRADサポートチャット インサイトダッシュボード")
 
-    client = OpenAI(api_key=st.secrets.OpenAIAPI.openai_api_key)
-
     def get_embeddings(texts):
-        embeddings = []
-        batch_size = 20
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i:i+batch_size]
-            response = client.embeddings.create(
-                model="text-embedding-3-small",
-                input=batch
-            )
-            batch_embeddings = [e.embedding for e in response.data]
-            embeddings.extend(batch_embeddings)
-        return np.array(embeddings)
-
-    def convert_timestamps_to_str(df):
-        for col in df.columns:
-            if pd.api.types.is_datetime64_any_dtype(df[col]):
-                df[col] = df[col].dt.strftime('%Y-%m-%d %H:%M:%S')
-            else:
-                if not df[col].empty and isinstance(df[col].iloc[0], datetime.date):
-                    df[col] = df[col].astype(str)
-        return df
-
-    def save_insight_to_gsheet(data: pd.DataFrame, sheet_name: str):
-        scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-        raw_info = st.secrets["GoogleSheets"]["service_account_info"]
-        if isinstance(raw_info, str):
-            info = json.loads(raw_info)
-        else:
-            info = raw_info
-        creds = Credentials.from_service_account_info(info, scopes=scope)
-        gc = gspread.authorize(creds)
+        return get_question_embeddings().get_many(texts, get_embedding_client().embed)
+
+    def save_insight_to_gsheet(data: pd.DataFrame, sheet_name: str, window):
+        # 前回までに送った行は送り直さず、新しい行だけを追記する（表示期間や列の変更時などは全体を書き直す）
         sheet_key = st.secrets["GoogleSheets"]["sheet_key"]
-        sh = gc.open_by_key(sheet_key)
         try:
-            worksheet = sh.worksheet(sheet_name)
-        except gspread.WorksheetNotFound:
-            worksheet = sh.add_worksheet(title=sheet_name, rows="1000", cols="20")
-        worksheet.clear()
-        data_to_save = convert_timestamps_to_str(data.copy())
-        worksheet.update([data_to_save.columns.values.tolist()] + data_to_save.values.tolist())
+            return SheetExporter(get_insight_spreadsheet(), state_key=sheet_key).sync(data, sheet_name, window=window)
+        except Exception:
+            # 認証切れなどに備えて、次回は接続から作り直す
+            get_insight_spreadsheet.clear()
+            raise
 
     LOG_FILE = "chat_logs.csv"
     if not os.path.exists(LOG_FILE):
         st.warning("⚠️ チャットログ（chat_logs.csv）が見つかりません。")
         st.stop()
 
-    df = pd.read_csv(LOG_FILE)
+    store = get_log_store()
+    store.sync_from_csv(LOG_FILE)
+    min_date, max_date = store.date_bounds()
 
-    if df.empty:
+    if min_date is None:
         st.info("チャットログがまだ保存されていません。")
         st.stop()
 
-    df["timestamp"] = pd.to_datetime(df["timestamp"])
-    df["date"] = df["timestamp"].dt.date
-    df["hour"] = df["timestamp"].dt.hour
-    df["month"] = df["timestamp"].dt.to_period("M").astype(str)
-
     st.sidebar.header("🔍 絞り込み")
-    min_date = df["date"].min()
-    max_date = df["date"].max()
     selected_range = st.sidebar.date_input("表示する期間", (min_date, max_date))
 
     if isinstance(selected_range, tuple):
@@ -83,40 +118,52 @@ def show_insights():
     else:
         start_date = end_date = selected_range
 
-    filtered_df = df[(df["date"] >= start_date) & (df["date"] <= end_date)]
+    filtered_df = load_logs(start_date, end_date, store.version)
+    rollup = load_rollup(start_date, end_date, store.version)
     st.sidebar.write(f"表示件数: {len(filtered_df)} 件")
 
     questions = filtered_df["question"].fillna("").tolist()
 
     if len(questions) > 0:
-        with st.spinner("質問をベクトル化中..."):
-            embeddings = get_embeddings(questions)
-
-        if embeddings.shape[0] < 2:
+        clusters, failed = None, False
+        with st.spinner("質問をクラスタリング中..."):
+            try:
+                clusters = get_cluster_cache().window(start_date, end_date).update(
+                    questions, store.version, get_embeddings
+                )
+            except EmbeddingError as e:
+                failed = True
+                st.error(f"{e}（クラスタリングをスキップします）")
+            except ValueError as e:
+                failed = True
+                st.error(f"Embeddingに無効な値が含まれています: {e}")
+
+        if failed:
+            pass
+        elif clusters is None:
             st.warning("質問が少なすぎてクラスタリングをスキップします。")
         else:
-            if np.isnan(embeddings).any():
-                st.error("Embeddingに無効な値が含まれています。")
-            else:
-                num_clusters = min(5, embeddings.shape[0])
-                kmeans = KMeans(n_clusters=num_clusters, random_state=42)
-                clusters = kmeans.fit_predict(embeddings)
-                filtered_df["cluster"] = clusters
-
-                st.subheader("質問の自動クラスタリング結果")
-                for cluster_num in range(num_clusters):
-                    st.write(f"### クラスタ {cluster_num + 1}")
-                    cluster_questions = filtered_df[filtered_df["cluster"] == cluster_num]["question"]
-                    if not cluster_questions.empty:
-                        st.write(f"代表質問例: {cluster_questions.iloc[0]}")
-                        st.write(f"質問数: {len(cluster_questions)}")
-                        with st.expander("質問一覧を表示"):
-                            st.write(cluster_questions.tolist())
+            filtered_df["cluster"] = [clusters.labels[q] for q in questions]
+
+            st.subheader("質問の自動クラスタリング結果")
+            for cluster_num in range(clusters.n_clusters):
+                st.write(f"### クラスタ {cluster_num + 1}")
+                cluster_questions = filtered_df[filtered_df["cluster"] == cluster_num]["question"]
+                if not cluster_questions.empty:
+                    st.write(f"代表質問例: {clusters.representatives[cluster_num]}")
+                    st.write(f"質問数: {len(cluster_questions)}")
+                    with st.expander("質問一覧を表示"):
+                        st.write(cluster_questions.tolist())
 
     if st.button("📤 Google Sheetsに保存（Insights）"):
         try:
-            save_insight_to_gsheet(filtered_df, sheet_name="Insights")
-            st.success("✅ Google Sheets に保存しました！")
+            result = save_insight_to_gsheet(filtered_df, sheet_name="Insights", window=(start_date, end_date))
+            if result["mode"] == "noop":
+                st.success("✅ Google Sheets は最新です（追加する行はありません）")
+            elif result["mode"] == "append":
+                st.success(f"✅ Google Sheets に {result['rows']} 行を追記しました！")
+            else:
+                st.success(f"✅ Google Sheets に {result['rows']} 行を保存しました！（全体を書き直し: {result['reason']}）")
         except Exception as e:
             st.error(f"❌ 保存に失敗しました: {e}")
 
@@ -125,7 +172,7 @@ def show_insights():
     st.bar_chart(top_questions)
 
     st.subheader("🕒 時間帯別の質問数（0〜23時）")
-    hourly_counts = filtered_df.groupby("hour").size().reindex(range(24), fill_value=0)
+    hourly_counts = rollup.groupby("hour")["count"].sum().reindex(range(24), fill_value=0)
     fig1, ax1 = plt.subplots()
     sns.barplot(x=hourly_counts.index, y=hourly_counts.values, ax=ax1, palette="Blues_d")
     ax1.set_xlabel("時間帯")
@@ -133,17 +180,49 @@ def show_insights():
     st.pyplot(fig1)
 
     st.subheader("🗓 月別の質問数")
-    monthly_counts = filtered_df.groupby("month").size()
+    monthly_counts = rollup.groupby(rollup["date"].dt.to_period("M").astype(str))["count"].sum()
     st.line_chart(monthly_counts)
 
-    if "category" in df.columns:
+    stage_cols = [c for c in STAGE_COLUMNS if c in filtered_df.columns and filtered_df[c].notna().any()]
+    if stage_cols:
+        st.subheader("⏱ 段階別の応答時間（ミリ秒）")
+        latency = filtered_df[stage_cols].quantile([0.5, 0.95, 0.99]).T
+        latency.columns = ["p50", "p95", "p99"]
+        latency.insert(0, "件数", filtered_df[stage_cols].notna().sum())
+        latency.index = [STAGE_LABELS[c] for c in stage_cols]
+        st.dataframe(latency.round(1), use_container_width=True)
+
+        selected_stage = st.selectbox(
+            "日別の推移を表示する段階", stage_cols, index=len(stage_cols) - 1, format_func=STAGE_LABELS.get
+        )
+        daily_latency = (
+            filtered_df.groupby("date")[selected_stage].quantile([0.5, 0.95, 0.99]).unstack().dropna(how="all")
+        )
+        daily_latency.columns = ["p50", "p95", "p99"]
+        st.line_chart(daily_latency)
+
+        if "route" in filtered_df.columns:
+            st.subheader("🔀 回答経路の内訳")
+            routes = filtered_df["route"].replace("", np.nan).dropna()
+            st.bar_chart(routes.map(lambda r: ROUTE_LABELS.get(r, r)).value_counts())
+        if "query_cache" in filtered_df.columns:
+            cache = filtered_df["query_cache"].replace("", np.nan).dropna()
+            if len(cache):
+                st.caption(f"質問埋め込みのキャッシュヒット率: {(cache != 'miss').mean() * 100:.1f}%")
+        token_cols = [c for c in ["prompt_tokens", "completion_tokens"] if c in filtered_df.columns]
+        if token_cols and filtered_df[token_cols].notna().any().any():
+            tokens = filtered_df[token_cols].sum()
+            st.caption(f"トークン数合計: 入力 {int(tokens.get('prompt_tokens', 0))} / 出力 {int(tokens.get('completion_tokens', 0))}")
+
+    if "category" in filtered_df.columns:
         st.subheader("🏷 カテゴリ別の質問数")
         category_counts = filtered_df["category"].value_counts()
         st.bar_chart(category_counts)
 
-    if "faq_matched" in df.columns:
+    if "faq_matched" in filtered_df.columns:
         st.subheader("❓ FAQ外質問の割合")
-        matched_counts = filtered_df["faq_matched"].value_counts(normalize=True) * 100
+        matched = filtered_df["faq_matched"].astype(str).str.lower().map({"true": True, "false": False})
+        matched_counts = matched.value_counts(normalize=True) * 100
         labels = ["FAQに該当", "該当せず"]
         values = [matched_counts.get(True, 0), matched_counts.get(False, 0)]
         fig2, ax2 = plt.subplots()
@@ -1,15 +1,22 @@
 import streamlit as st
 import openai
 import pandas as pd
-import numpy as np
-import re, os, json, unicodedata, base64
-from datetime import datetime, timezone, timedelta
-import gspread
-from google.oauth2.service_account import Credentials
-from sklearn.metrics.pairwise import cosine_similarity
+import re, os, base64
 import traceback
 import random
-import time
+import uuid
+from lrad.faq_store import FaqEmbeddingStore
+from lrad.embedding_client import EmbeddingClient
+from lrad.query_cache import QueryEmbeddingCache
+from lrad.faq_index import FaqIndex
+from lrad.retrieval import HybridRetriever, ExactAnswerTable
+from lrad.answer_cache import AnswerCache
+from lrad.pipeline import ChatPipeline
+from lrad.admission import AdmissionController
+from lrad.single_flight import SingleFlight
+from lrad.tenants import CorpusRegistry, tenant_faq_path
+from lrad.chat_history import ChatHistory, ChatHistoryStore
+from lrad.log_sink import CSV_LOG_COLUMNS, BatchedLogSink, CsvLogWriter, GoogleSheetsWriter, LogPipeline
 
 st.set_page_config(page_title="LRADチャット", layout="centered")
 
@@ -20,6 +27,43 @@ USER_CREDENTIALS = {
     "Bcorp": "mypassword3",
 }
 
+EMBEDDING_MODEL = "text-embedding-3-small"
+# 埋め込みの次元数（None はモデルの既定値 1536）。変更するとFAQの埋め込みは自動的に再計算される
+EMBEDDING_DIMENSIONS = None
+# FAQインデックスの保持形式（"float32" / "float16" / "int8"）と、float32 で計算し直す上位候補数
+# int8 はメモリを1/4にできるが、numpy では float32 の行列積より検索が遅い（bench.quant_report 参照）。
+# FAQが大きくメモリが足りない場合だけ "int8"（FAQ_INDEX_RERANK = 20）にする
+FAQ_INDEX_PRECISION = "float32"
+FAQ_INDEX_RERANK = 0
+# この類似度未満のFAQしか見つからない場合は「関連FAQなし」として扱う
+FAQ_MIN_SIMILARITY = 0.3
+# 語彙一致率と類似度がともにこの値以上なら、LLMを使わずFAQの回答をそのまま返す
+FAST_PATH_LEXICAL = 0.8
+FAST_PATH_DENSE = 0.85
+COMMON_FAQ_PATHS = ["faq_common_jp.csv", "faq_common_en.csv"]
+# テナント専用のFAQは faq_tenants/<ログインID>.csv に置く（無ければ faq_all.csv を使う）
+FAQ_TENANT_DIR = "faq_tenants"
+# 読み込んだFAQインデックスの合計がこの値を超えたら、最近使われていないものから解放する
+FAQ_MEMORY_BUDGET_MB = 512
+# 同じFAQ行への質問で類似度がこの値以上なら、生成済みの回答を再利用する
+ANSWER_CACHE_RADIUS = 0.95
+ANSWER_CACHE_MAX_ENTRIES = 2000
+ANSWER_CACHE_TTL = 7 * 24 * 3600
+# 回答をトークン単位で逐次表示する
+STREAM_RESPONSES = True
+# OpenAI API の同時呼び出し数（プロセス全体）。超えた分はテナントごとに順番待ちさせる
+OPENAI_CONCURRENCY = {"embedding": 8, "chat": 16}
+ADMISSION_MAX_QUEUE = 100
+ADMISSION_MAX_WAIT = 60
+# 画面に表示する直近のターン数（「以前の会話を表示」を押すごとに同じ数ずつ増やす）
+CHAT_HISTORY_WINDOW = 20
+# セッション内に持つ会話の上限。超えた古いターンはディスク上の履歴ストアへ移す
+CHAT_HISTORY_MEMORY_TURNS = 50
+CHAT_HISTORY_MEMORY_KB = 256
+# 履歴ストアにはセッションごとに最大この件数を、最終更新から一定期間だけ保存する
+CHAT_HISTORY_MAX_TURNS = 1000
+CHAT_HISTORY_TTL = 7 * 24 * 3600
+
 # Step 1: 言語設定とサイドバーUI
 lang = st.sidebar.selectbox("言語を選択 / Select Language", ["日本語", "English"], index=0)
 
@@ -33,15 +77,21 @@ font_size_map_jp = {"小": "14px", "中": "18px", "大": "24px"}
 font_size_map_en = {"Small": "14px", "Medium": "18px", "Large": "24px"}
 selected_font_size = font_size_map_jp[font_size] if lang == "日本語" else font_size_map_en[font_size]
 
-st.markdown(
-    f"""
+# ページ共通のCSSは文字サイズごとに一度だけ組み立て、1回の描画でまとめて挿入する
+@st.cache_resource
+def page_css(font_size):
+    return f"""
     <style>
-        div[data-testid="stVerticalBlock"] * {{ font-size: {selected_font_size}; }}
-        section[data-testid="stSidebar"] * {{ font-size: {selected_font_size}; }}
+        div[data-testid="stVerticalBlock"] * {{ font-size: {font_size}; }}
+        section[data-testid="stSidebar"] * {{ font-size: {font_size}; }}
+        /* 選択肢のプレースホルダー（空文字）の表示色を薄くする */
+        div[data-baseweb="select"] > div > div:first-child {{
+            color: #999999 !important;
+        }}
     </style>
-    """,
-    unsafe_allow_html=True
-)
+    """
+
+st.markdown(page_css(selected_font_size), unsafe_allow_html=True)
 
 WELCOME_MESSAGES = [
     "ようこそ！LRADチャットボットへ。",
@@ -60,6 +110,8 @@ LOGIN_PASSWORD_PLACEHOLDER = "パスワードを入力" if lang == "日本語" e
 LOGIN_ERROR_MSG = "ユーザーIDまたはパスワードが間違っています" if lang == "日本語" else "Incorrect user ID or password"
 WELCOME_CAPTION = "※このチャットボットはFAQとAIをもとに応答しますが、すべての質問に正確に回答できるとは限りません。" if lang == "日本語" else "This chatbot responds based on FAQ and AI, but may not answer all questions accurately."
 CHAT_INPUT_PLACEHOLDER = "質問をどうぞ..." if lang == "日本語" else "Ask your question..."
+LOAD_EARLIER_LABEL = "⬆️ 以前の会話を表示" if lang == "日本語" else "⬆️ Show earlier messages"
+QUEUED_MESSAGE = "⏳ ただいま混み合っています。{position}番目に受付中です…" if lang == "日本語" else "⏳ We're busy right now. You are #{position} in the queue…"
 
 if "authenticated" not in st.session_state:
     st.session_state["authenticated"] = False
@@ -69,42 +121,40 @@ if "show_welcome" not in st.session_state:
     st.session_state["show_welcome"] = False
 if "welcome_message" not in st.session_state:
     st.session_state["welcome_message"] = ""
-if "fade_out" not in st.session_state:
-    st.session_state["fade_out"] = False
-if "chat_log" not in st.session_state:
-    st.session_state["chat_log"] = []
+if "history_pages" not in st.session_state:
+    st.session_state["history_pages"] = 1
 if "show_login_success" not in st.session_state:
     st.session_state["show_login_success"] = False
     
+# ログイン成功時はフォームを消して同じ実行のまま画面表示を続ける（再実行・待機なし）
 def password_check():
     if not st.session_state["authenticated"]:
-        with st.form("login_form"):
-            st.title(LOGIN_TITLE)
-            user_id = st.text_input("", key="login_user", placeholder=LOGIN_USER_PLACEHOLDER)
-            password = st.text_input("", type="password", key="login_pass", placeholder=LOGIN_PASSWORD_PLACEHOLDER)
-            submitted = st.form_submit_button(LOGIN_TITLE)
-            if submitted:
-                if USER_CREDENTIALS.get(user_id) == password:
-                    st.session_state["authenticated"] = True
-                    st.session_state["user_id"] = user_id
-                    st.session_state["show_welcome"] = True
-                    st.session_state["welcome_message"] = random.choice(WELCOME_MESSAGES)
-                    st.session_state["fade_out"] = False
-                    st.session_state["show_login_success"] = True
-                    st.experimental_rerun()
-                else:
+        login_area = st.empty()
+        with login_area.container():
+            with st.form("login_form"):
+                st.title(LOGIN_TITLE)
+                user_id = st.text_input("", key="login_user", placeholder=LOGIN_USER_PLACEHOLDER)
+                password = st.text_input("", type="password", key="login_pass", placeholder=LOGIN_PASSWORD_PLACEHOLDER)
+                submitted = st.form_submit_button(LOGIN_TITLE)
+                if submitted and USER_CREDENTIALS.get(user_id) != password:
                     st.error(LOGIN_ERROR_MSG)
-        st.stop()
+        if not (submitted and USER_CREDENTIALS.get(user_id) == password):
+            st.stop()
+        login_area.empty()
+        st.session_state["authenticated"] = True
+        st.session_state["user_id"] = user_id
+        st.session_state["show_welcome"] = True
+        st.session_state["welcome_message"] = random.choice(WELCOME_MESSAGES)
+        st.session_state["show_login_success"] = True
 
 password_check()
 
 # --- ログイン成功時メッセージ表示 ---
 if st.session_state.get("show_login_success", False):
-    st.success("✅ ログイン完了しました！")
-    time.sleep(1.5)
+    st.toast("✅ ログイン完了しました！")
     st.session_state["show_login_success"] = False
-    st.experimental_rerun()
-    
+
+# フェードイン → 表示 → フェードアウトまでをブラウザ側のCSSアニメーションで行う
 def show_welcome_screen():
     st.markdown(
         f"""
@@ -118,17 +168,16 @@ def show_welcome_screen():
             align-items: center;
             font-size: 56px;
             font-weight: bold;
-            animation: fadein 1.5s forwards;
+            animation: fadein 1.5s forwards, fadeout 1s 2s forwards;
             z-index: 9999;
             text-align: center;
             padding: 0 20px;
             word-break: break-word;
         }}
-        .fadeout {{ animation: fadeout 1.5s forwards; }}
         @keyframes fadein {{ from {{ opacity: 0; }} to {{ opacity: 1; }} }}
-        @keyframes fadeout {{ from {{ opacity: 1; }} to {{ opacity: 0; }} }}
+        @keyframes fadeout {{ from {{ opacity: 1; }} to {{ opacity: 0; visibility: hidden; }} }}
         </style>
-        <div class="fullscreen {'fadeout' if st.session_state['fade_out'] else ''}">
+        <div class="fullscreen">
             {st.session_state['welcome_message']}
         </div>
         """,
@@ -137,14 +186,7 @@ def show_welcome_screen():
 
 if st.session_state["show_welcome"]:
     show_welcome_screen()
-    if not st.session_state["fade_out"]:
-        time.sleep(2)
-        st.session_state["fade_out"] = True
-        st.experimental_rerun()
-    else:
-        time.sleep(1)
-        st.session_state["show_welcome"] = False
-        st.experimental_rerun()
+    st.session_state["show_welcome"] = False
 
 # --- OpenAI API設定 ---
 try:
@@ -164,35 +206,73 @@ def is_valid_input(text):
     return True
 
 # --- 埋め込み取得 ---
-def get_embedding(text):
-    text = text.replace("\n", " ")
-    try:
-        res = openai.embeddings.create(input=[text], model="text-embedding-3-small")
-        return res.data[0].embedding
-    except Exception as e:
-        st.error(f"埋め込み取得に失敗しました: {e}")
-        return np.zeros(1536)
+# バッチ化・並列化・リトライ付きのクライアントを全セッションで共有する
+@st.cache_resource
+def get_embedding_client():
+    return EmbeddingClient(model=EMBEDDING_MODEL, dimensions=EMBEDDING_DIMENSIONS)
+
+# 複数セッションから同時に来た同じ質問は、埋め込み・回答生成とも1回のAPI呼び出しにまとめる
+@st.cache_resource
+def get_single_flight():
+    return SingleFlight()
+
+# 同じ質問は正規化したキーでキャッシュし、埋め込みAPIを呼ばない
+@st.cache_resource
+def get_query_cache():
+    client = get_embedding_client()
+    return QueryEmbeddingCache(client.embed_one, model=client.cache_key, single_flight=get_single_flight())
+
+def embed_texts(texts):
+    return get_embedding_client().embed(texts)
 
 # --- FAQ読み込みと埋め込み計算 ---
-@st.cache_data
-def load_faq(path="faq_all.csv"):
-    df = pd.read_csv(path)
-    df["embedding"] = df["質問"].apply(lambda x: get_embedding(str(x)))
-    return df
+# 埋め込みはディスク上のストアに保存し、追加・変更された質問だけを再計算する
+# 正規化済みのベクトルインデックスとBM25インデックスはFAQのバージョンごとに一度だけ作る
+# FAQの質問とほぼ同文の入力には埋め込みもLLMも使わずに回答する
+def build_faq_corpus(snapshot):
+    retriever = HybridRetriever(
+        FaqIndex.from_snapshot(snapshot, precision=FAQ_INDEX_PRECISION, rerank=FAQ_INDEX_RERANK)
+    )
+    table = ExactAnswerTable(zip(snapshot.df["質問"], snapshot.df["回答"]))
+    for path in COMMON_FAQ_PATHS:
+        try:
+            table.add_csv(path)
+        except Exception:
+            continue
+    return retriever, table
+
+# テナント（ログインID）ごとのFAQは初回利用時に読み込み、同じテナントの全セッションで共有する
+@st.cache_resource
+def get_corpus_registry():
+    return CorpusRegistry(
+        lambda path: FaqEmbeddingStore(path, embed_fn=embed_texts, model=get_embedding_client().cache_key),
+        build_faq_corpus,
+        memory_budget=FAQ_MEMORY_BUDGET_MB * 2**20,
+    )
 
-faq_df = load_faq()
+def load_faq(tenant):
+    try:
+        corpus = get_corpus_registry().get(tenant_faq_path(tenant, FAQ_TENANT_DIR))
+    except Exception as e:
+        st.error(f"FAQの埋め込み読み込みに失敗しました: {e}")
+        st.stop()
+    return corpus.retriever, corpus.exact_answers
 
-image_base64 = ""
-try:
-    with open("LRADimg.png", "rb") as img_file:
-        image_base64 = base64.b64encode(img_file.read()).decode()
-except Exception:
-    pass
+faq_index, exact_answers = load_faq(st.session_state.get("user_id"))
+
+# ロゴはプロセスごとに一度だけ読み込んで data URI にする
+@st.cache_resource
+def get_logo_data_uri(path="LRADimg.png"):
+    try:
+        with open(path, "rb") as img_file:
+            return "data:image/png;base64," + base64.b64encode(img_file.read()).decode()
+    except Exception:
+        return ""
 
 title_text = "LRADサポートチャット" if lang == "日本語" else "LRAD Support Chat"
 st.markdown(f"""
     <div style="display:flex; align-items:center;">
-        <img src="data:image/png;base64,{image_base64}" width="80" style="margin-right:10px;">
+        <img src="{get_logo_data_uri()}" width="80" style="margin-right:10px;">
         <h1 style="margin:0; font-size:32px;">{title_text}</h1>
     </div>
 """, unsafe_allow_html=True)
@@ -201,48 +281,46 @@ st.caption(WELCOME_CAPTION)
 # FAQファイル読み込みとカテゴリUIへの変更
 faq_common_path = "faq_common_jp.csv" if lang == "日本語" else "faq_common_en.csv"
 
-@st.cache_data
+# よくある質問は カテゴリ → 行番号 の索引とあわせてプロセスごとに一度だけ作る
+@st.cache_resource
 def load_common_faq(path):
     try:
         df = pd.read_csv(path)
-        return df
     except Exception as e:
         st.error(f"よくある質問ファイルの読み込みに失敗しました: {e}")
-        return pd.DataFrame(columns=["カテゴリ", "質問", "回答"] if lang == "日本語" else ["category", "question", "answer"])
-
-common_faq_df = load_common_faq(faq_common_path)
+        df = pd.DataFrame(columns=["カテゴリ", "質問", "回答"] if lang == "日本語" else ["category", "question", "answer"])
+    # 1列目がカテゴリ（カンマ区切りで複数指定可）
+    cat_col = df.columns[0] if len(df.columns) else None
+    category_rows = {}
+    if cat_col is not None:
+        for position, cell in enumerate(df[cat_col]):
+            if pd.isna(cell):
+                continue
+            for cat in str(cell).split(','):
+                rows = category_rows.setdefault(cat.strip(), [])
+                if not rows or rows[-1] != position:
+                    rows.append(position)
+    categories = sorted(category_rows)
+    return df, categories, category_rows
+
+common_faq_df, common_categories, common_category_rows = load_common_faq(faq_common_path)
 
 with st.expander("💡 よくある質問" if lang == "日本語" else "💡 FAQ", expanded=False):
     if not common_faq_df.empty:
-        cat_col = "カテゴリ" if lang == "日本語" else "category"
         q_col = "質問" if lang == "日本語" else "question"
         a_col = "回答" if lang == "日本語" else "answer"
 
-        categories = sorted(set(cat.strip() for sublist in common_faq_df[cat_col].dropna().str.split(',') for cat in sublist))
         all_label = "すべて" if lang == "日本語" else "All"
-        categories = ["", all_label] + categories
+        categories = ["", all_label] + common_categories
 
         select_placeholder = "カテゴリを選択してください" if lang == "日本語" else "Choose a category"
         selected_tag = st.selectbox(label=" ", options=categories, index=0, format_func=lambda x: x if x else select_placeholder)
 
-        # 選択肢のプレースホルダー（空文字）の表示色を薄くするCSS
-        st.markdown(
-            """
-            <style>
-            div[data-baseweb="select"] > div > div:first-child {
-                color: #999999 !important;
-            }
-            </style>
-            """,
-            unsafe_allow_html=True,
-        )
-
         if selected_tag:
             if selected_tag == all_label:
                 filtered_df = common_faq_df
             else:
-                filtered_df = common_faq_df[common_faq_df[cat_col].apply(
-                    lambda x: selected_tag in [cat.strip() for cat in str(x).split(',')])]
+                filtered_df = common_faq_df.iloc[common_category_rows.get(selected_tag, [])]
 
             for _, row in filtered_df.iterrows():
                 st.markdown(f"**Q. {row[q_col]}**")
@@ -250,100 +328,128 @@ with st.expander("💡 よくある質問" if lang == "日本語" else "💡 FAQ
                 st.markdown("---")
 
 
-# --- 類似質問検索 ---
-def find_top_similar(q, df, k=1):
-    q_vec = get_embedding(q)
-    try:
-        faq_vecs = np.stack(df["embedding"].to_numpy())
-        sims = cosine_similarity([q_vec], faq_vecs)[0]
-        idx = sims.argsort()[::-1][:k][0]
-        return df.iloc[idx]["質問"], df.iloc[idx]["回答"]
-    except Exception:
-        return None, None
-
-# --- AI回答生成 ---
-def generate_response(user_q, ref_q, ref_a):
-    system_prompt = (
-        "あなたはLRAD（遠赤外線電子熱分解装置）の専門家です。\n"
-        "LRADの導入実績はまだありません。\n"
-        "もし質問が「見積もり」や「問い合わせ先」に関するものであれば、必ず次のリンクを案内してください。ただし、URLの後ろに句読点は絶対付けないでください。：https://imugenos.com/pages\n"
-        "「お問合せ先」に関連しない質問には、URLを貼らないでください。\n"
-        f"FAQ質問: {ref_q}\nFAQ回答: {ref_a}\n"
-        "この情報をもとに200文字以内で簡潔にユーザーの質問に答えてください。"
-    )
-    messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_q}]
+# --- 類似質問検索とAI回答生成 ---
+CHAT_MODEL = "gpt-3.5-turbo"
+
+@st.cache_resource
+def get_answer_cache():
+    return AnswerCache(radius=ANSWER_CACHE_RADIUS, max_entries=ANSWER_CACHE_MAX_ENTRIES, ttl=ANSWER_CACHE_TTL)
+
+@st.cache_resource
+def get_admission():
+    return AdmissionController(OPENAI_CONCURRENCY, max_queue=ADMISSION_MAX_QUEUE, max_wait=ADMISSION_MAX_WAIT)
+
+chat_pipeline = ChatPipeline(
+    retriever=faq_index,
+    exact_answers=exact_answers,
+    query_cache=get_query_cache(),
+    answer_cache=get_answer_cache(),
+    single_flight=get_single_flight(),
+    admission=get_admission(),
+    chat_client=openai,
+    chat_model=CHAT_MODEL,
+    min_similarity=FAQ_MIN_SIMILARITY,
+    fast_path_lexical=FAST_PATH_LEXICAL,
+    fast_path_dense=FAST_PATH_DENSE,
+)
+
+# --- ログ保存処理（省略可能） ---
+# ログはバックグラウンドでまとめて書き込み、書けなかった分は spool に残して再送する
+# CSV には段階別の処理時間・キャッシュ利用・類似度・トークン数も追加列として記録する
+LOG_SPOOL_DIR = ".lrad_cache/log_spool"
+
+@st.cache_resource
+def get_log_pipeline():
+    csv_writer = CsvLogWriter("chat_logs.csv", CSV_LOG_COLUMNS)
+    sinks = [BatchedLogSink(csv_writer.write, os.path.join(LOG_SPOOL_DIR, "csv.jsonl"))]
     try:
-        res = openai.chat.completions.create(
-            model="gpt-3.5-turbo", messages=messages, temperature=0.3
+        writer = GoogleSheetsWriter(
+            st.secrets["GoogleSheets"]["sheet_key"],
+            st.secrets["GoogleSheets"]["service_account_info"],
         )
-        return res.choices[0].message.content.strip()
+        sinks.append(BatchedLogSink(writer.write, os.path.join(LOG_SPOOL_DIR, "gsheet.jsonl")))
     except Exception as e:
-        st.error(f"AI回答生成に失敗しました: {e}")
-        return "申し訳ありません。回答の生成中にエラーが発生しました。"
+        st.warning(f"Google Sheetsへの保存設定の読み込みに失敗しました: {e}")
+    return LogPipeline(sinks)
 
-# --- ログ保存処理（省略可能） ---
-def append_to_csv(q, a, path="chat_logs.csv"):
+def append_to_logs(q, a, **metrics):
     try:
-        df = pd.DataFrame([{"timestamp": pd.Timestamp.now().isoformat(), "question": q, "answer": a}])
-        if not os.path.exists(path):
-            df.to_csv(path, index=False)
-        else:
-            df.to_csv(path, mode="a", header=False, index=False)
+        get_log_pipeline().log(st.session_state.get("user_id", "default"), q, a, **metrics)
     except Exception as e:
-        st.warning(f"CSV保存失敗: {e}")
+        st.warning(f"ログ保存失敗: {e}")
 
-def append_to_gsheet(q, a):
+# --- 会話履歴 ---
+# 画面から外れた古いターンは全セッション共有の SQLite に移し、セッション内には直近分だけを持つ
+@st.cache_resource
+def get_chat_history_store():
     try:
-        JST = timezone(timedelta(hours=9))
-        timestamp = datetime.now(JST).strftime("%Y-%m-%d %H:%M:%S")
-        sheet_key = st.secrets["GoogleSheets"]["sheet_key"]
-        service_account_info = st.secrets["GoogleSheets"]["service_account_info"]
-        if isinstance(service_account_info, str):
-            service_account_info = json.loads(service_account_info)
-        scopes = [
-            "https://www.googleapis.com/auth/spreadsheets",
-            "https://www.googleapis.com/auth/drive",
-        ]
-        creds = Credentials.from_service_account_info(service_account_info, scopes=scopes)
-        gc = gspread.authorize(creds)
-        sh = gc.open_by_key(sheet_key)
-
-        user_id = st.session_state.get("user_id", "default")
-        try:
-            worksheet = sh.worksheet(user_id)  # 既存シート取得
-        except gspread.exceptions.WorksheetNotFound:
-            worksheet = sh.add_worksheet(title=user_id, rows="1000", cols="3")  # なければ作成
-            worksheet.append_row(["timestamp", "question", "answer"])
-
-        worksheet.append_row([timestamp, q, a], value_input_option="USER_ENTERED")
-
+        return ChatHistoryStore(ttl=CHAT_HISTORY_TTL, max_turns=CHAT_HISTORY_MAX_TURNS)
     except Exception as e:
-        st.warning(f"Google Sheetsへの保存に失敗しました: {e}")
+        st.warning(f"会話履歴の保存先を開けませんでした（古い会話は保存されません）: {e}")
+        return None
+
+if "chat_history" not in st.session_state:
+    st.session_state["chat_history"] = ChatHistory(
+        uuid.uuid4().hex,
+        store=get_chat_history_store(),
+        max_memory_turns=CHAT_HISTORY_MEMORY_TURNS,
+        max_memory_bytes=CHAT_HISTORY_MEMORY_KB * 1024,
+    )
+chat_history = st.session_state.chat_history
+
+def load_earlier():
+    st.session_state.history_pages += 1
 
 # --- チャット表示と処理 ---
-for q, a in st.session_state.chat_log:
+# 表示するのは直近の CHAT_HISTORY_WINDOW × ページ数 のターンだけ
+try:
+    visible_turns, has_earlier = chat_history.window(CHAT_HISTORY_WINDOW * st.session_state.history_pages)
+except Exception as e:
+    st.warning(f"以前の会話の読み込みに失敗しました: {e}")
+    visible_turns = [(q, a) for _, q, a in chat_history.turns[-CHAT_HISTORY_WINDOW:]]
+    has_earlier = False
+if has_earlier:
+    st.button(LOAD_EARLIER_LABEL, on_click=load_earlier)
+for q, a in visible_turns:
     st.chat_message("user").write(q)
     if a:
         st.chat_message("assistant").write(a)
 
 user_q = st.chat_input(CHAT_INPUT_PLACEHOLDER)
 
+# 質問の表示から回答・ログ保存までを1回の実行で行う
 if user_q:
     if not is_valid_input(user_q):
         st.warning("入力が不正です。3〜300文字、記号率30%未満にしてください。")
     else:
-        st.session_state.chat_log.append((user_q, None))
-        st.experimental_rerun()
-
-if st.session_state.chat_log and st.session_state.chat_log[-1][1] is None:
-    last_q = st.session_state.chat_log[-1][0]
-    ref_q, ref_a = find_top_similar(last_q, faq_df)
-    if ref_q is None:
-        answer = "申し訳ありません、関連FAQが見つかりませんでした。"
-    else:
-        with st.spinner("回答生成中…"):
-            answer = generate_response(last_q, ref_q, ref_a)
-    st.session_state.chat_log[-1] = (last_q, answer)
-    append_to_csv(last_q, answer)
-    append_to_gsheet(last_q, answer)
-    st.experimental_rerun()
+        st.chat_message("user").write(user_q)
+        chat_history.ask(user_q)
+        # 新しい質問をしたら表示を直近の範囲に戻す
+        st.session_state.history_pages = 1
+
+# 回答前に中断されたターンもここで回答する
+if chat_history.pending is not None:
+    last_q = chat_history.pending
+    with st.chat_message("assistant"):
+        placeholder = st.empty()
+        tenant = st.session_state.get("user_id")
+        # 混雑時はエラーにせず、順番待ちの状態を表示する
+        on_wait = lambda position: placeholder.markdown(QUEUED_MESSAGE.format(position=position))
+        if STREAM_RESPONSES:
+            # トークンを受信するたびに placeholder へ描画する
+            result = chat_pipeline.answer(
+                last_q, lang, on_text=lambda text: placeholder.markdown(text + "▌"), tenant=tenant, on_wait=on_wait
+            )
+        else:
+            with st.spinner("回答生成中…"):
+                result = chat_pipeline.answer(last_q, lang, tenant=tenant, on_wait=on_wait)
+        if result.error:
+            st.error(result.error)
+        answer = result.answer
+        placeholder.markdown(answer)
+    # 回答が完成してから履歴とログに確定させる
+    try:
+        chat_history.answer(answer)
+    except Exception as e:
+        st.warning(f"会話履歴の保存に失敗しました: {e}")
+    append_to_logs(last_q, answer, **result.metrics())
@@ -0,0 +1,92 @@
+import hashlib
+import re
+import threading
+import time
+import types
+
+import numpy as np
+
+from lrad.lexical import char_ngrams
+
+
+# --- OpenAI API のローカル代替（決定的・オフライン） ---
+# 埋め込みは文字 n-gram のハッシュベクトル、チャットはプロンプト中のFAQ回答を返す。
+# latency は呼び出しごとの待ち時間（秒）で、API の往復時間を模擬する。
+def hashed_embedding(text, dim=256):
+    vec = np.zeros(dim, dtype=np.float32)
+    for gram in char_ngrams(text, sizes=(1, 2, 3)):
+        h = int.from_bytes(hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest(), "little")
+        vec[h % dim] += 1.0 if (h >> 32) & 1 else -1.0
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm > 0 else vec
+
+
+class FakeEmbeddings:
+    def __init__(self, owner, dim, latency):
+        self.owner = owner
+        self.dim = dim
+        self.latency = latency
+
+    def create(self, input, model, dimensions=None, **kwargs):
+        self.owner.count("embeddings", len(input))
+        time.sleep(self.latency)
+        data = [
+            types.SimpleNamespace(index=i, embedding=self.vector(t, dimensions).tolist())
+            for i, t in enumerate(input)
+        ]
+        return types.SimpleNamespace(data=data)
+
+    def vector(self, text, dimensions=None):
+        # text-embedding-3 系と同じく、短い次元は先頭を切り出して正規化し直したものとする
+        vec = hashed_embedding(text, self.dim)
+        if dimensions and dimensions < self.dim:
+            vec = vec[:dimensions]
+            norm = np.linalg.norm(vec)
+            vec = vec / norm if norm > 0 else vec
+        return vec
+
+
+class FakeChatCompletions:
+    def __init__(self, owner, ttft, token_latency, chunk_chars=4, max_chars=200):
+        self.owner = owner
+        self.ttft = ttft
+        self.token_latency = token_latency
+        self.chunk_chars = chunk_chars
+        self.max_chars = max_chars
+
+    def create(self, model, messages, stream=False, stream_options=None, **kwargs):
+        self.owner.count("chat", 1)
+        match = re.search(r"FAQ回答: (.*)\n", messages[0]["content"])
+        text = (match.group(1) if match else "")[:self.max_chars]
+        chunks = [text[i:i + self.chunk_chars] for i in range(0, len(text), self.chunk_chars)]
+        # トークン数は1チャンク=1トークンとして概算する
+        usage = types.SimpleNamespace(
+            prompt_tokens=sum(len(m["content"]) for m in messages) // self.chunk_chars,
+            completion_tokens=len(chunks),
+        )
+        if stream:
+            return self._stream(chunks, usage if (stream_options or {}).get("include_usage") else None)
+        time.sleep(self.ttft + self.token_latency * len(chunks))
+        message = types.SimpleNamespace(content=text)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=usage)
+
+    def _stream(self, chunks, usage=None):
+        time.sleep(self.ttft)
+        for chunk in chunks:
+            time.sleep(self.token_latency)
+            delta = types.SimpleNamespace(content=chunk)
+            yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=delta)], usage=None)
+        if usage is not None:
+            yield types.SimpleNamespace(choices=[], usage=usage)
+
+
+class FakeOpenAI:
+    def __init__(self, dim=256, embed_latency=0.05, ttft=0.3, token_latency=0.01):
+        self.calls = {"embeddings": 0, "chat": 0}
+        self._lock = threading.Lock()
+        self.embeddings = FakeEmbeddings(self, dim, embed_latency)
+        self.chat = types.SimpleNamespace(completions=FakeChatCompletions(self, ttft, token_latency))
+
+    def count(self, key, n):
+        with self._lock:
+            self.calls[key] += n
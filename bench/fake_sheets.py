@@ -0,0 +1,79 @@
+import gspread
+
+
+# --- Google Sheets API のローカル代替（SheetExporter が使うメソッドのみ） ---
+# 値は USER_ENTERED で入力した後の見た目と同じく文字列で保持し、API 呼び出しごとの
+# 回数と送受信したセル数を requests に記録する。max_request_cells を超える書き込みは失敗させる。
+class FakeWorksheet:
+    def __init__(self, owner, title, rows, cols):
+        self.owner = owner
+        self.title = title
+        self.row_count = int(rows)
+        self.col_count = int(cols)
+        self.values = []
+
+    def append_rows(self, values, value_input_option=None, **kwargs):
+        self.owner.record("append_rows", values)
+        self.values.extend([self._cell(v) for v in row] for row in values)
+        self.row_count = max(self.row_count, len(self.values))
+
+    def update(self, values, range_name=None, **kwargs):
+        # 旧実装（clear 後に A1 から全体を1回で書く）の比較用
+        self.owner.record("update", values)
+        self.values = [[self._cell(v) for v in row] for row in values]
+        self.row_count = max(self.row_count, len(self.values))
+
+    def clear(self):
+        self.owner.record("clear", [])
+        self.values = []
+
+    def resize(self, rows=None, cols=None):
+        self.owner.record("resize", [])
+        self.row_count = int(rows) if rows is not None else self.row_count
+        self.col_count = int(cols) if cols is not None else self.col_count
+
+    def col_values(self, col):
+        self.owner.record("read", [], write=False)
+        values = [row[col - 1] if len(row) >= col else "" for row in self.values]
+        while values and values[-1] == "":
+            values.pop()
+        return values
+
+    def row_values(self, row):
+        self.owner.record("read", [], write=False)
+        values = list(self.values[row - 1]) if len(self.values) >= row else []
+        while values and values[-1] == "":
+            values.pop()
+        return values
+
+    @staticmethod
+    def _cell(value):
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        return str(value)
+
+
+class FakeSpreadsheet:
+    def __init__(self, max_request_cells=None):
+        self.max_request_cells = max_request_cells
+        self.worksheets = {}
+        self.requests = []
+
+    def worksheet(self, title):
+        if title not in self.worksheets:
+            raise gspread.WorksheetNotFound(title)
+        return self.worksheets[title]
+
+    def add_worksheet(self, title, rows, cols):
+        self.record("add_worksheet", [])
+        self.worksheets[title] = FakeWorksheet(self, title, rows, cols)
+        return self.worksheets[title]
+
+    def record(self, method, values, write=True):
+        cells = sum(len(row) for row in values)
+        if self.max_request_cells is not None and cells > self.max_request_cells:
+            raise RuntimeError(f"リクエストが大きすぎます: {cells} cells > {self.max_request_cells}")
+        self.requests.append({"method": method, "cells": cells, "write": write})
+
+    def reset_requests(self):
+        self.requests = []
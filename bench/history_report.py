@@ -0,0 +1,75 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from lrad.chat_history import ChatHistory, ChatHistoryStore
+
+
+# --- 会話の長さと、1回の再実行で扱う履歴の量の関係 ---
+# 従来（全ターンをセッションに持ち、毎回すべて描画）と、ChatHistory の表示範囲・セッション内の量を比べる。
+def make_turn(i, answer_chars):
+    return f"LRADの質問その{i}について教えてください", ("回答" * answer_chars)[:answer_chars]
+
+
+def measure(n_turns, store, window, memory_turns, memory_kb, answer_chars, repeats):
+    history = ChatHistory(f"bench-{n_turns}", store=store, max_memory_turns=memory_turns,
+                          max_memory_bytes=memory_kb * 1024)
+    chat_log = []
+    for i in range(n_turns):
+        q, a = make_turn(i, answer_chars)
+        history.ask(q)
+        history.answer(a)
+        chat_log.append((q, a))
+
+    def timed(fn):
+        samples = []
+        for _ in range(repeats):
+            t = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - t)
+        return float(np.median(samples)) * 1000
+
+    turns, _ = history.window(window)
+    return {
+        "turns": n_turns,
+        "old_rendered": len(chat_log),
+        "old_session_kb": sum(len(q.encode()) + len(a.encode()) for q, a in chat_log) / 1024,
+        "rendered": len(turns),
+        "session_kb": history.memory_bytes / 1024,
+        "window_ms": timed(lambda: history.window(window)),
+        # セッション外（ストア）のターンまで遡って表示する場合
+        "store_page_ms": timed(lambda: history.window(memory_turns + window)),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="会話履歴の表示範囲とセッション内メモリの計測")
+    parser.add_argument("--turns", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--window", type=int, default=20)
+    parser.add_argument("--memory-turns", type=int, default=50)
+    parser.add_argument("--memory-kb", type=int, default=256)
+    parser.add_argument("--answer-chars", type=int, default=400)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ChatHistoryStore(os.path.join(tmp, "chat_history.sqlite3"), max_turns=max(args.turns))
+        rows = [measure(n, store, args.window, args.memory_turns, args.memory_kb, args.answer_chars, args.repeats)
+                for n in args.turns]
+        db_kb = os.path.getsize(store.path) / 1024
+
+    print(f"{'turns':>6} {'old render':>10} {'old KB':>8} {'render':>7} {'session KB':>10} "
+          f"{'window':>9} {'from store':>10}")
+    for r in rows:
+        print(f"{r['turns']:>6} {r['old_rendered']:>10} {r['old_session_kb']:>8.0f} {r['rendered']:>7} "
+              f"{r['session_kb']:>10.0f} {r['window_ms']:>7.3f}ms {r['store_page_ms']:>8.3f}ms")
+    print(f"history store: {db_kb:.0f} KB on disk")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from lrad.embedding_client import EmbeddingClient
+from lrad.faq_index import PRECISIONS, FaqIndex
+from lrad.faq_store import read_faq_csv
+
+from bench.fake_openai import FakeOpenAI
+from bench.queries import build_query_set
+
+FULL_DIMENSIONS = 1536
+
+
+# --- 次元数・精度ごとの検索品質（float32・全次元に対する再現率）と速度・サイズ ---
+def top_k(index, q_vecs, k):
+    results, elapsed = [], 0.0
+    for q in q_vecs:
+        t = time.perf_counter()
+        hits = index.search(q, k=k)
+        elapsed += time.perf_counter() - t
+        results.append([h.position for h in hits])
+    return results, elapsed / max(1, len(q_vecs))
+
+
+def evaluate(faq, queries, client, dimensions, configs, k, baseline):
+    embedder = EmbeddingClient(client=client, dimensions=None if dimensions == FULL_DIMENSIONS else dimensions)
+    vectors = embedder.embed(faq["質問"].tolist())
+    q_vecs = embedder.embed([q.text for q in queries])
+    expected = {q: i for i, q in enumerate(faq["質問"])}
+    rows = []
+    for precision, rerank in configs:
+        index = FaqIndex(faq, vectors, precision=precision, rerank=rerank)
+        results, per_query = top_k(index, q_vecs, k)
+        base = baseline if baseline is not None else results
+        rows.append({
+            "dimensions": dimensions,
+            "precision": precision,
+            "rerank": rerank,
+            "index_bytes": int(index.matrix.nbytes + (index.scale.nbytes if index.scale is not None else 0)),
+            "search_us": per_query * 1e6,
+            f"recall@{k}": float(np.mean([len(set(r) & set(b)) / len(b) for r, b in zip(results, base) if b])),
+            "top1_agreement": float(np.mean([r[:1] == b[:1] for r, b in zip(results, base)])),
+            "top1_accuracy": float(np.mean([r[:1] == [expected[q.expected_question]] for r, q in zip(results, queries)])),
+        })
+        if baseline is None:
+            baseline = results
+    return rows, baseline
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="量子化FAQインデックスの再現率・速度・サイズの比較")
+    parser.add_argument("--faq", default="faq_all.csv")
+    parser.add_argument("--dimensions", type=int, nargs="+", default=[FULL_DIMENSIONS, 512, 256])
+    parser.add_argument("--precisions", nargs="+", default=list(PRECISIONS), choices=PRECISIONS)
+    parser.add_argument("--rerank", type=int, nargs="+", default=[0, 20])
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--json", help="結果をJSONで書き出すパス")
+    args = parser.parse_args(argv)
+
+    client = FakeOpenAI(dim=FULL_DIMENSIONS, embed_latency=0.0)
+    faq = read_faq_csv(args.faq)
+    queries = [q for q in build_query_set(args.faq, []) if q.source == args.faq]
+    # 基準（float32・全次元・リランクなし）を先頭に置く
+    configs = [("float32", 0)] + [
+        (p, r) for p in args.precisions for r in args.rerank if (p, r) != ("float32", 0) and (p != "float32" or r == 0)
+    ]
+    dims = [FULL_DIMENSIONS] + [d for d in args.dimensions if d != FULL_DIMENSIONS]
+
+    rows, baseline = [], None
+    for d in dims:
+        result, baseline = evaluate(faq, queries, client, d, configs, args.k, baseline)
+        rows.extend(result)
+
+    base = rows[0]
+    print(f"{len(faq)} FAQ rows / {len(queries)} queries, baseline float32 x {FULL_DIMENSIONS}")
+    print(f"{'dims':>5} {'precision':>9} {'rerank':>6} {'index':>10} {'size':>6} {'search':>9} "
+          f"{f'recall@{args.k}':>9} {'top1 agr':>8} {'top1 acc':>8}")
+    for r in rows:
+        print(
+            f"{r['dimensions']:>5} {r['precision']:>9} {r['rerank']:>6} {r['index_bytes'] / 1024:>8.1f}KB "
+            f"{base['index_bytes'] / r['index_bytes']:>5.1f}x {r['search_us']:>7.1f}us "
+            f"{r[f'recall@{args.k}']:>9.3f} {r['top1_agreement']:>8.3f} {r['top1_accuracy']:>8.3f}"
+        )
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,48 @@
+import re
+from collections import namedtuple
+
+import pandas as pd
+
+from lrad.faq_store import read_faq_csv
+
+LabeledQuery = namedtuple("LabeledQuery", ["text", "kind", "expected_question", "expected_answer", "source"])
+
+
+# --- FAQ の質問から言い換えクエリを作る ---
+def _is_japanese(text):
+    return re.search(r"[ぁ-んァ-ン一-龥]", text) is not None
+
+
+def paraphrases(question):
+    base = question.rstrip("？?。. ")
+    if _is_japanese(question):
+        variants = [
+            ("exact", question),
+            ("width", question.replace("？", "?").replace("（", "(").replace("）", ")") + " "),
+            ("polite", f"{base}について教えてください"),
+            ("prefix", f"すみません、{base}？"),
+            ("truncated", base[:max(4, int(len(base) * 0.7))]),
+        ]
+    else:
+        variants = [
+            ("exact", question),
+            ("width", f"  {question.lower()} "),
+            ("polite", f"Could you tell me: {base}?"),
+            ("prefix", f"Hi, {base[:1].lower()}{base[1:]}?"),
+            ("truncated", base[:max(8, int(len(base) * 0.7))]),
+        ]
+    return variants
+
+
+def build_query_set(faq_path="faq_all.csv", common_paths=("faq_common_jp.csv", "faq_common_en.csv")):
+    queries = []
+    faq = read_faq_csv(faq_path)
+    for q, a in zip(faq["質問"], faq["回答"]):
+        for kind, text in paraphrases(q):
+            queries.append(LabeledQuery(text, kind, q, a, faq_path))
+    for path in common_paths:
+        common = pd.read_csv(path)
+        for q, a in zip(common.iloc[:, 1].astype(str), common.iloc[:, 2].astype(str)):
+            for kind, text in paraphrases(q):
+                queries.append(LabeledQuery(text, kind, q, a, path))
+    return queries
@@ -0,0 +1,298 @@
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from lrad import question_clusters
+from lrad.answer_cache import AnswerCache
+from lrad.chat_history import INTERRUPTED_ANSWER, ChatHistory, ChatHistoryStore
+from lrad.faq_index import FaqIndex
+from lrad.log_sink import BatchedLogSink
+from lrad.query_cache import QueryEmbeddingCache
+from lrad.retrieval import HybridRetriever
+
+from bench.fake_openai import FakeOpenAI
+from bench.queries import build_query_set
+from bench.run_bench import build_pipeline
+
+CHECKS = {}
+
+
+def check(fn):
+    CHECKS[fn.__name__] = fn
+    return fn
+
+
+# --- 回帰チェック ---
+# レビューで見つかった不具合の再現手順を、ローカル代替だけで実行できる形で残す。
+# 各チェックは [(内容, 期待どおりか), ...] を返す。
+def unit(*pairs, dim=8):
+    # 基底ベクトルの組み合わせ（(軸, 係数), ...）から正規化済みベクトルを作る
+    vec = np.zeros(dim, dtype=np.float32)
+    for axis, weight in pairs:
+        vec[axis] = weight
+    return vec / np.linalg.norm(vec)
+
+
+def faq_retriever(rows):
+    # rows: [(質問, ベクトル), ...]
+    df = pd.DataFrame({"質問": [q for q, _ in rows], "回答": [f"回答{i}" for i in range(len(rows))]})
+    return HybridRetriever(FaqIndex(df, np.stack([v for _, v in rows])))
+
+
+@check
+def fusion_lexical_vs_dense():
+    # 語彙と密ベクトルの判断が食い違う場合。語尾（「ますか」）だけの一致で順位が逆転しないこと、
+    # 一方でほぼ同文の一致は密ベクトルの小差より優先されること
+    query_vec = unit((0, 1.0))
+    retriever = faq_retriever([
+        ("LRADの保証期間はありますか", unit((0, 0.40), (1, np.sqrt(1 - 0.40 ** 2)))),
+        ("装置の処理能力を知りたい", unit((0, 0.60), (2, 0.80))),
+    ])
+    results = []
+    top = retriever.search("一日に何トン処理できますか", query_vec, k=2)
+    results.append((
+        f"弱い語彙一致は密ベクトルを覆さない: top={top[0].question}（dense={top[0].dense:.2f}）",
+        top[0].question == "装置の処理能力を知りたい",
+    ))
+    query_vec = unit((0, 1.0))
+    retriever = faq_retriever([
+        ("LRADの保証期間はありますか", unit((0, 0.55), (1, np.sqrt(1 - 0.55 ** 2)))),
+        ("装置の処理能力を知りたい", unit((0, 0.60), (2, 0.80))),
+    ])
+    top = retriever.search("LRADの保証期間はありますか？", query_vec, k=2)
+    results.append((
+        f"強い語彙一致は密ベクトルの小差より優先: top={top[0].question}（lexical={top[0].lexical:.2f}）",
+        top[0].question == "LRADの保証期間はありますか",
+    ))
+    return results
+
+
+class FlakyWriter:
+    # down の間は失敗し、書けたレコードの通し番号を順に記録する
+    def __init__(self):
+        self.down = True
+        self.written = []
+
+    def write(self, records):
+        if self.down:
+            raise ConnectionError("書き込み先に接続できません")
+        self.written.extend(r["n"] for r in records)
+
+
+@check
+def log_spool_outage():
+    # 書き込み先の障害中に溜まったログを、メモリ上限を守ったまま spool から順に1回ずつ送ること
+    results = []
+    for n in (5000, 20000):
+        with tempfile.TemporaryDirectory() as tmp:
+            spool = os.path.join(tmp, "gsheet.jsonl")
+            writer = FlakyWriter()
+            sink = BatchedLogSink(writer.write, spool, flush_interval=3600, max_buffered=1000)
+            for i in range(n):
+                sink.put({"n": i, "question": "質問" * 20, "answer": "回答" * 100})
+            buffered = sink.buffered()
+            writer.down = False
+            t = time.perf_counter()
+            for _ in range(n // 100):
+                sink._flush_once()
+            # 半分送ったところでプロセスが落ちた想定（close せずに作り直す）。書き込み済みの位置から続きを送る
+            sink = BatchedLogSink(writer.write, spool, flush_interval=3600, max_buffered=1000)
+            sink.flush()
+            drain = time.perf_counter() - t
+            sink.close()
+            results.append((
+                f"{n}件: 障害中のメモリ上={buffered}件, 復旧後の送信={drain * 1000:.0f}ms, "
+                f"spool={os.path.getsize(spool)}B",
+                buffered <= 1000 and writer.written == list(range(n)) and os.path.getsize(spool) == 0,
+            ))
+    return results
+
+
+def topic_vector(text, dim=32):
+    # 「話題N:」の N ごとに近いベクトル（話題の基底 + 文面ごとの小さな揺らぎ）
+    topic = int(text.split(":")[0][2:])
+    vec = np.random.default_rng(topic).normal(size=dim)
+    vec += 0.2 * np.random.default_rng(zlib.crc32(text.encode())).normal(size=dim)
+    return (vec / np.linalg.norm(vec)).astype(np.float32)
+
+
+@check
+def cluster_window_reuse():
+    # 既定の表示期間（終了日が毎日進む）で全体を学習し直さないこと。
+    # 狭めた期間は広い期間の重心を流用し、どちらもクラスタ数の選択をやり直さないこと
+    days = [(d, [f"話題{(d * 7 + i) % 6}: 質問{d}-{i}" for i in range(8)]) for d in range(60)]
+
+    def questions(start, end):
+        return [q for d, qs in days if start <= d <= end for q in qs]
+
+    embedded = []
+
+    def embed_batch(texts):
+        embedded.extend(texts)
+        return [topic_vector(t) for t in texts]
+
+    selections = []
+    choose = question_clusters.choose_n_clusters
+
+    def counting_choose(*args, **kwargs):
+        selections.append(1)
+        return choose(*args, **kwargs)
+
+    tmp = tempfile.TemporaryDirectory()
+    # Insights と同じく、ベクトルは QueryEmbeddingCache（ディスク）から引く
+    embeddings = QueryEmbeddingCache(None, model="fake", path=os.path.join(tmp.name, "questions.sqlite3"))
+
+    def embed_many(texts):
+        return embeddings.get_many(texts, embed_batch)
+
+    question_clusters.choose_n_clusters = counting_choose
+    try:
+        cache = question_clusters.ClusterCache()
+        results = []
+        steps = [
+            ("初回", 0, 58, 1),
+            ("終了日が1日進む", 0, 59, 2),
+            ("期間を狭める", 10, 50, 2),
+        ]
+        for name, start, end, version in steps:
+            before_sel, before_emb = len(selections), len(embedded)
+            clusters = cache.window(start, end)
+            t = time.perf_counter()
+            result = clusters.update(questions(start, end), version, embed_many)
+            elapsed = time.perf_counter() - t
+            reselected = len(selections) > before_sel
+            new_embeds = len(embedded) - before_emb
+            expected = name == "初回" or not reselected
+            if name == "終了日が1日進む":
+                expected = expected and new_embeds == len(days[59][1]) and len(cache._windows) == 1
+            if name == "期間を狭める":
+                expected = expected and new_embeds == 0
+            results.append((
+                f"{name}: {elapsed * 1000:.0f}ms, クラスタ数={result.n_clusters}, "
+                f"選び直し={'あり' if reselected else 'なし'}, 新規の埋め込み={new_embeds}件",
+                expected,
+            ))
+    finally:
+        question_clusters.choose_n_clusters = choose
+        embeddings.disk._conn.close()
+        tmp.cleanup()
+    return results
+
+
+class Interrupted(BaseException):
+    # Streamlit の再実行（RerunException）と同じく Exception ではない中断
+    pass
+
+
+@check
+def single_flight_leader_interrupted():
+    # 生成を先に始めたセッションが描画中に中断されても、同じ質問を待つセッションに回答が届き、
+    # 回答キャッシュにも入ること
+    args = types.SimpleNamespace(faq="faq_all.csv", common=[], dimensions=None, precision="float32", rerank=0,
+                                 min_similarity=0.3, embed_limit=8, chat_limit=16, max_queue=100)
+    client = FakeOpenAI(embed_latency=0.0, ttft=0.05, token_latency=0.01)
+    with tempfile.TemporaryDirectory() as workdir:
+        pipeline, _ = build_pipeline(args, workdir, client)
+        lang = "日本語"
+        query = next(q.text for q in build_query_set(args.faq, []) if q.kind == "polite"
+                     and pipeline.answer(q.text, lang).route == "generated")
+        pipeline.answer_cache = AnswerCache()
+
+        followers = 4
+        barrier = threading.Barrier(followers + 1)
+        leader_state = {}
+        results = [None] * followers
+
+        def interrupt(text):
+            raise Interrupted()
+
+        def leader():
+            try:
+                leader_state["result"] = pipeline.answer(query, lang, on_text=interrupt)
+            except Interrupted:
+                leader_state["interrupted"] = True
+
+        def follower(i):
+            barrier.wait()
+            results[i] = pipeline.answer(query, lang, on_text=lambda text: None)
+
+        before = client.calls["chat"]
+        threads = [threading.Thread(target=follower, args=(i,)) for i in range(followers)]
+        for t in threads:
+            t.start()
+        leading = threading.Thread(target=leader)
+        leading.start()
+        # 先行する生成が始まってから後続のセッションを送る
+        while pipeline.single_flight.in_flight() == 0 and leading.is_alive():
+            time.sleep(0.001)
+        barrier.wait()
+        for t in threads + [leading]:
+            t.join(timeout=30)
+        chat_calls = client.calls["chat"] - before
+        after = pipeline.answer(query, lang)
+
+    delivered = sum(r is not None and r.route == "generated" and "generation" in r.coalesced for r in results)
+    return [
+        (f"先行セッションの中断: {'あり' if leader_state.get('interrupted') else 'なし'}",
+         leader_state.get("interrupted", False)),
+        (f"後続セッションへの回答: {delivered}/{followers}, チャットAPI呼び出し={chat_calls}回",
+         delivered == followers and chat_calls == 1),
+        (f"中断後の同じ質問: route={after.route}", after.route == "answer_cache"),
+    ]
+
+
+@check
+def chat_history_interrupted_turn():
+    # 回答前に次の質問が来た（生成中の再実行など）ターンが残っても、セッション内の上限が効くこと。
+    # 中断されたターンは回答待ちのまま残らず、中断と分かる回答で閉じること
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ChatHistoryStore(os.path.join(tmp, "chat_history.sqlite3"))
+        for label, history_store in (("store あり", store), ("store なし", None)):
+            history = ChatHistory("check", store=history_store, max_memory_turns=5)
+            peak = 0
+            for i in range(40):
+                history.ask(f"質問{i}")
+                peak = max(peak, history.stats()["memory_turns"])
+                if i % 3 != 2:
+                    # 3回に2回は回答前に次の質問が来る
+                    continue
+                history.answer(f"回答{i}")
+                peak = max(peak, history.stats()["memory_turns"])
+            turns, _ = history.window(40)
+            unanswered = [q for q, a in turns[:-1] if a is None]
+            interrupted = sum(a == INTERRUPTED_ANSWER for _, a in turns)
+            expected_turns = 40 if history_store is not None else 5
+            results.append((
+                f"{label}: 40ターン中セッション内の最大={peak}件, 回答待ちのまま={len(unanswered)}件, "
+                f"中断として閉じた={interrupted}件, 最後の質問={history.pending}",
+                peak <= 5 and not unanswered and len(turns) == expected_turns and history.pending == "質問39"
+                and (history_store is None or interrupted == 26),
+            ))
+        store._conn.close()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="不具合の再現ケースの確認（オフライン）")
+    parser.add_argument("--only", nargs="*", choices=sorted(CHECKS), help="実行するチェック（省略時はすべて）")
+    args = parser.parse_args(argv)
+
+    failures = 0
+    for name in args.only or CHECKS:
+        for description, ok in CHECKS[name]():
+            failures += not ok
+            print(f"{'ok' if ok else 'NG'}  {name}: {description}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,251 @@
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+import numpy as np
+
+from lrad.admission import AdmissionController
+from lrad.answer_cache import AnswerCache
+from lrad.embedding_client import EmbeddingClient
+from lrad.faq_index import PRECISIONS, FaqIndex
+from lrad.faq_store import FaqEmbeddingStore
+from lrad.pipeline import ChatPipeline
+from lrad.query_cache import QueryEmbeddingCache
+from lrad.retrieval import ExactAnswerTable, HybridRetriever
+from lrad.single_flight import SingleFlight
+
+from bench.fake_openai import FakeOpenAI
+from bench.queries import build_query_set
+
+STAGES = ["embedding", "retrieval", "ttft", "generation", "total"]
+
+
+# --- パイプラインの組み立て（app.py と同じ構成をローカル代替 API で作る） ---
+def build_pipeline(args, workdir, client):
+    embedder = EmbeddingClient(client=client, requests_per_second=1000, dimensions=args.dimensions)
+    store = FaqEmbeddingStore(
+        args.faq, embed_fn=embedder.embed, model=embedder.cache_key, root=os.path.join(workdir, "faq_store")
+    )
+    snapshot = store.snapshot()
+    retriever = HybridRetriever(FaqIndex.from_snapshot(snapshot, precision=args.precision, rerank=args.rerank))
+    exact = ExactAnswerTable(zip(snapshot.df["質問"], snapshot.df["回答"]))
+    for path in args.common:
+        exact.add_csv(path)
+    single_flight = SingleFlight()
+    query_cache = QueryEmbeddingCache(
+        embedder.embed_one, model=embedder.cache_key, path=os.path.join(workdir, "query_cache.sqlite3"),
+        single_flight=single_flight,
+    )
+    pipeline = ChatPipeline(
+        retriever, exact, query_cache, AnswerCache(), client,
+        min_similarity=args.min_similarity, single_flight=single_flight,
+        admission=AdmissionController(
+            {"embedding": args.embed_limit, "chat": args.chat_limit}, max_queue=args.max_queue
+        ),
+    )
+    return pipeline, embedder
+
+
+# --- 検索精度（top-1 / top-k） ---
+# 期待する質問が検索対象（faq_all）にあるクエリだけを評価する
+def evaluate_retrieval(pipeline, embedder, queries, k, faq_path):
+    targets = [q for q in queries if q.source == faq_path]
+    vectors = embedder.embed([q.text for q in targets])
+    top1, topk = Counter(), Counter()
+    totals = Counter()
+    for q, vec in zip(targets, vectors):
+        hits = pipeline.retriever.search(q.text, vec, k=k)
+        questions = [h.question for h in hits]
+        totals[q.kind] += 1
+        top1[q.kind] += int(bool(questions) and questions[0] == q.expected_question)
+        topk[q.kind] += int(q.expected_question in questions)
+    n = sum(totals.values())
+    return {
+        "queries": n,
+        "top1": sum(top1.values()) / n if n else 0.0,
+        f"top{k}": sum(topk.values()) / n if n else 0.0,
+        "by_kind": {kind: {"top1": top1[kind] / c, f"top{k}": topk[kind] / c} for kind, c in totals.items()},
+    }
+
+
+# --- 同時セッションでの実行 ---
+# セッションは tenants 個のテナントに順に割り当てる
+def run_sessions(pipeline, queries, sessions, stream, tenants=3, lang="日本語"):
+    results = [None] * len(queries)
+
+    def session(worker):
+        on_text = (lambda text: None) if stream else None
+        tenant = f"tenant{worker % tenants}"
+        for i in range(worker, len(queries), sessions):
+            results[i] = pipeline.answer(queries[i].text, lang, on_text=on_text, tenant=tenant)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=session, args=(w,)) for w in range(sessions)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    return results, elapsed
+
+
+# --- 同じ質問の同時集中（single-flight の効果） ---
+def run_burst(pipeline, client, query, sessions, stream, lang="日本語"):
+    barrier = threading.Barrier(sessions)
+    results = [None] * sessions
+    before = dict(client.calls)
+
+    def session(i):
+        on_text = (lambda text: None) if stream else None
+        barrier.wait()
+        results[i] = pipeline.answer(query, lang, on_text=on_text)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(sessions)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return {
+        "sessions": sessions,
+        "elapsed_s": time.perf_counter() - started,
+        "api_calls": {k: client.calls[k] - before[k] for k in client.calls},
+        "coalesced": dict(Counter(stage for r in results for stage in r.coalesced)),
+        "routes": dict(Counter(r.route for r in results)),
+    }
+
+
+def is_correct(query, result):
+    if result.route in ("exact", "fast_path"):
+        return result.answer == query.expected_answer
+    if result.route in ("generated", "answer_cache"):
+        return result.top_hit is not None and result.top_hit.question == query.expected_question
+    return False
+
+
+def summarize_run(queries, results, elapsed):
+    latency = {}
+    for stage in STAGES:
+        values = np.array([r.timings[stage] for r in results if r.timings.get(stage) is not None]) * 1000
+        if len(values):
+            latency[stage] = {
+                "n": int(len(values)),
+                "p50_ms": float(np.percentile(values, 50)),
+                "p95_ms": float(np.percentile(values, 95)),
+                "p99_ms": float(np.percentile(values, 99)),
+            }
+    correct = sum(is_correct(q, r) for q, r in zip(queries, results))
+    return {
+        "turns": len(results),
+        "elapsed_s": elapsed,
+        "throughput_tps": len(results) / elapsed if elapsed else 0.0,
+        "answer_accuracy": correct / len(results) if results else 0.0,
+        "routes": dict(Counter(r.route for r in results)),
+        "latency": latency,
+    }
+
+
+def format_report(report):
+    lines = []
+    r = report["retrieval"]
+    k = report["config"]["k"]
+    lines.append(f"== 検索精度 ({r['queries']} queries)")
+    lines.append(f"top1={r['top1']:.3f}  top{k}={r[f'top{k}']:.3f}")
+    for kind, v in sorted(r["by_kind"].items()):
+        lines.append(f"  {kind:<10} top1={v['top1']:.3f}  top{k}={v[f'top{k}']:.3f}")
+    for phase in ("cold", "warm"):
+        run = report[phase]
+        lines.append(f"== {phase}: {run['turns']} turns / {report['config']['sessions']} sessions")
+        lines.append(
+            f"throughput={run['throughput_tps']:.1f} turns/s  elapsed={run['elapsed_s']:.2f}s"
+            f"  answer_accuracy={run['answer_accuracy']:.3f}"
+        )
+        lines.append(f"routes={run['routes']}")
+        for stage, v in run["latency"].items():
+            lines.append(
+                f"  {stage:<11} n={v['n']:<5} p50={v['p50_ms']:8.2f}ms  p95={v['p95_ms']:8.2f}ms  p99={v['p99_ms']:8.2f}ms"
+            )
+    b = report["burst"]
+    lines.append(f"== burst: {b['sessions']} sessions x same question  elapsed={b['elapsed_s']:.2f}s")
+    lines.append(f"api_calls={b['api_calls']}  coalesced={b['coalesced']}  routes={b['routes']}")
+    lines.append(f"single_flight={report['single_flight']}")
+    for endpoint, a in report["admission"].items():
+        lines.append(
+            f"== admission {endpoint}: limit={a['limit']} admitted={a['admitted']} rejected={a['rejected']} "
+            f"max_queued={a['max_queued']} wait p50={a['wait_p50_ms']:.1f}ms p95={a['wait_p95_ms']:.1f}ms "
+            f"max={a['wait_max_ms']:.1f}ms"
+        )
+    m = report["memory"]
+    lines.append(f"== memory: python_peak={m['python_peak_mb']:.1f}MB  max_rss={m['max_rss_mb']:.1f}MB")
+    lines.append(f"== api calls: {report['api_calls']}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="LRAD 検索・回答パイプラインのオフラインベンチマーク")
+    parser.add_argument("--faq", default="faq_all.csv")
+    parser.add_argument("--common", nargs="*", default=["faq_common_jp.csv", "faq_common_en.csv"])
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--min-similarity", type=float, default=0.3)
+    parser.add_argument("--dimensions", type=int, help="埋め込みの次元数（省略時はモデルの既定値）")
+    parser.add_argument("--precision", default="float32", choices=PRECISIONS)
+    parser.add_argument("--rerank", type=int, default=0)
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--ttft", type=float, default=0.3)
+    parser.add_argument("--token-latency", type=float, default=0.01)
+    parser.add_argument("--no-stream", action="store_true")
+    parser.add_argument("--embed-limit", type=int, default=8, help="埋め込みAPIの同時呼び出し数")
+    parser.add_argument("--chat-limit", type=int, default=16, help="チャットAPIの同時呼び出し数")
+    parser.add_argument("--max-queue", type=int, default=100)
+    parser.add_argument("--json", help="結果をJSONで書き出すパス")
+    parser.add_argument("--min-top1", type=float, help="top1 がこの値を下回れば終了コード1")
+    args = parser.parse_args(argv)
+
+    tracemalloc.start()
+    client = FakeOpenAI(embed_latency=args.embed_latency, ttft=args.ttft, token_latency=args.token_latency)
+    queries = build_query_set(args.faq, args.common)
+    with tempfile.TemporaryDirectory() as workdir:
+        pipeline, embedder = build_pipeline(args, workdir, client)
+        retrieval = evaluate_retrieval(pipeline, embedder, queries, args.k, args.faq)
+        cold = summarize_run(queries, *run_sessions(pipeline, queries, args.sessions, not args.no_stream))
+        warm = summarize_run(queries, *run_sessions(pipeline, queries, args.sessions, not args.no_stream))
+        # 回答キャッシュを空にし、新しい言い換えを全セッションから同時に送る
+        pipeline.answer_cache = AnswerCache()
+        burst_query = next(q.text for q in queries if q.kind == "polite") + "（至急）"
+        burst = run_burst(pipeline, client, burst_query, args.sessions, not args.no_stream)
+    report = {
+        "config": vars(args),
+        "retrieval": retrieval,
+        "cold": cold,
+        "warm": warm,
+        "burst": burst,
+        "single_flight": pipeline.single_flight.stats(),
+        "admission": pipeline.admission.stats(),
+        "memory": {
+            "python_peak_mb": tracemalloc.get_traced_memory()[1] / 2**20,
+            "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        },
+        "api_calls": dict(client.calls),
+    }
+    tracemalloc.stop()
+
+    print(format_report(report))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.min_top1 is not None and retrieval["top1"] < args.min_top1:
+        print(f"top1 {retrieval['top1']:.3f} < {args.min_top1}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+import argparse
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from lrad.sheet_export import SheetExporter, sheet_values
+
+from bench.fake_sheets import FakeSpreadsheet, FakeWorksheet
+
+SHEET = "Insights"
+
+
+# --- SheetExporter をローカルの Sheets 代替で確認する ---
+# ログが増えていく状況と表示期間の変更を順に再現し、各段階で「シートの内容 = 期待する表」であることと、
+# 従来の clear → 一括 update と比べた書き込み量を確認する。
+def make_logs(n, seed=0):
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2025-01-01")
+    offsets = np.sort(rng.integers(0, 90 * 24 * 3600, n))
+    offsets[10:13] = offsets[10]  # 同時刻の行も含める
+    return pd.DataFrame({
+        "timestamp": start + pd.to_timedelta(offsets, unit="s"),
+        "question": [f"質問{i % 97}" for i in range(n)],
+        "answer": [f"回答{i}" for i in range(n)],
+        "total_ms": np.round(rng.uniform(5, 3000, n), 1),
+    })
+
+
+def clear_and_rewrite(spreadsheet, data, sheet_name):
+    # 従来の save_insight_to_gsheet と同じ書き方
+    try:
+        worksheet = spreadsheet.worksheet(sheet_name)
+    except Exception:
+        worksheet = spreadsheet.add_worksheet(title=sheet_name, rows="1000", cols="20")
+    worksheet.clear()
+    worksheet.update([[str(c) for c in data.columns]] + sheet_values(data))
+
+
+def expected_values(data):
+    data = data.sort_values("timestamp", kind="stable")
+    rows = [[str(c) for c in data.columns]] + sheet_values(data)
+    return [[FakeWorksheet._cell(v) for v in row] for row in rows]
+
+
+def view(logs, rows, start, end):
+    # 先頭 rows 行までが記録済みのログを、Insights と同じく日付の期間で絞り込む
+    data = logs.iloc[:rows]
+    dates = data["timestamp"].dt.date
+    start, end = pd.Timestamp(start).date(), pd.Timestamp(end).date()
+    return data[(dates >= start) & (dates <= end)], (start, end)
+
+
+def scenarios(logs):
+    n = len(logs)
+    # (名前, 記録済みの行数, 開始日, 終了日, 追加する列)
+    yield "初回", n // 2, "2025-01-01", "2025-03-31", None
+    yield "新しいログ（+50行）", n // 2 + 50, "2025-01-01", "2025-03-31", None
+    yield "変更なし", n // 2 + 50, "2025-01-01", "2025-03-31", None
+    yield "シートの手作業編集", n // 2 + 50, "2025-01-01", "2025-03-31", None
+    yield "新しいログ（+1行）", n // 2 + 51, "2025-01-01", "2025-03-31", None
+    yield "終了日の延長", n - 100, "2025-01-01", "2025-04-30", None
+    yield "期間の縮小", n - 100, "2025-01-06", "2025-04-30", None
+    yield "期間の移動", n - 100, "2025-03-01", "2025-03-31", None
+    yield "開始日を過去へ", n - 100, "2025-02-01", "2025-03-31", None
+    yield "列の追加", n - 100, "2025-02-01", "2025-03-31", "route"
+    yield "新しいログ（+100行）", n, "2025-02-01", "2025-03-31", "route"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Insights の Google Sheets 差分エクスポートの確認（オフライン）")
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--chunk-rows", type=int, default=500)
+    parser.add_argument("--max-request-cells", type=int, default=10000, help="1リクエストのセル数上限（模擬）")
+    args = parser.parse_args(argv)
+
+    logs = make_logs(args.rows)
+    delta = FakeSpreadsheet(max_request_cells=args.max_request_cells)
+    baseline = FakeSpreadsheet()
+    failures = 0
+    with tempfile.TemporaryDirectory() as state_dir:
+        exporter = SheetExporter(delta, state_dir=state_dir, chunk_rows=args.chunk_rows)
+        print(f"{'scenario':<24} {'mode':>8} {'rows':>6} {'writes':>6} {'cells':>8} {'baseline cells':>15}  ok")
+        for name, rows, start, end, extra in scenarios(logs):
+            data, window = view(logs, rows, start, end)
+            if extra:
+                data = data.assign(**{extra: "generated"})
+            if name == "シートの手作業編集":
+                # シート側が手作業で編集された場合（記録と行数が合わない）
+                delta.worksheet(SHEET).values.append(["手入力"])
+            delta.reset_requests()
+            baseline.reset_requests()
+            result = exporter.sync(data, SHEET, window=window)
+            clear_and_rewrite(baseline, data, SHEET)
+            ok = delta.worksheet(SHEET).values == expected_values(data)
+            failures += not ok
+            cells = sum(r["cells"] for r in delta.requests)
+            base_cells = sum(r["cells"] for r in baseline.requests)
+            writes = sum(r["write"] for r in delta.requests)
+            print(f"{name:<24} {result['mode']:>8} {result['rows']:>6} {writes:>6} {cells:>8} {base_cells:>15}  "
+                  f"{'ok' if ok else 'NG'} {result.get('reason', '')}")
+
+    # 1リクエストのサイズ上限を超えると従来方式は失敗する
+    try:
+        clear_and_rewrite(FakeSpreadsheet(max_request_cells=args.max_request_cells), logs, SHEET)
+        print("clear-and-rewrite: 上限内")
+    except RuntimeError as e:
+        print(f"clear-and-rewrite: {e}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
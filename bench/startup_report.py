@@ -0,0 +1,131 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ASSETS = ["faq_all.csv", "faq_common_jp.csv", "faq_common_en.csv", "LRADimg.png"]
+HEAVY_MODULES = ["sklearn", "gspread", "google.oauth2", "matplotlib", "seaborn"]
+
+
+# --- 子プロセス: 新しいプロセスで app.py を AppTest で実行して計測する ---
+def measure(app_path, reruns, user_id):
+    import openai
+
+    from bench.fake_openai import FakeOpenAI
+
+    fake = FakeOpenAI(embed_latency=0.0, ttft=0.0, token_latency=0.0)
+    openai.embeddings = fake.embeddings
+    openai.chat = fake.chat
+
+    started = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+    from streamlit.testing.v1 import element_tree
+    streamlit_import = time.perf_counter() - started
+
+    # AppTest は空文字の選択肢（よくある質問のプレースホルダー）を再実行時に解決できないため、先頭として扱う
+    selectbox_index = element_tree.Selectbox.index.fget
+
+    def safe_index(self):
+        try:
+            return selectbox_index(self)
+        except ValueError:
+            return 0
+
+    element_tree.Selectbox.index = property(safe_index)
+
+    # AppTest 自体が読み込むモジュールは除き、app の実行で読み込まれたものだけを数える
+    preloaded = set(sys.modules)
+    at = AppTest.from_file(app_path, default_timeout=120)
+    at.secrets["OpenAIAPI"] = {"openai_api_key": "x"}
+    timings = {"streamlit_import": streamlit_import}
+
+    t = time.perf_counter()
+    at.run()
+    timings["login_page"] = time.perf_counter() - t
+    at.session_state["authenticated"] = True
+    at.session_state["user_id"] = user_id
+
+    t = time.perf_counter()
+    at.run()
+    timings["first_chat_page"] = time.perf_counter() - t
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+
+    rerun = []
+    for _ in range(reruns):
+        t = time.perf_counter()
+        at.run()
+        rerun.append(time.perf_counter() - t)
+    timings["rerun"] = rerun
+    timings["heavy_modules"] = [m for m in HEAVY_MODULES if m in sys.modules and m not in preloaded]
+    return timings
+
+
+def run_child(app_path, workdir, reruns, user_id):
+    # 新しいプロセスで起動し、インポートとキャッシュ構築を含めたコールドスタートを測る
+    cmd = [sys.executable, "-m", "bench.startup_report", "--child", app_path,
+           "--reruns", str(reruns), "--user", user_id]
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    out = subprocess.run(cmd, cwd=workdir, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def summarize(samples):
+    def ms(values):
+        return float(np.median(values)) * 1000
+
+    return {
+        "login_page_ms": ms([s["login_page"] for s in samples]),
+        "first_chat_page_ms": ms([s["first_chat_page"] for s in samples]),
+        "rerun_p50_ms": ms([r for s in samples for r in s["rerun"]]),
+        "rerun_p95_ms": float(np.percentile([r for s in samples for r in s["rerun"]], 95)) * 1000,
+        "heavy_modules": samples[-1]["heavy_modules"],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="app.py の起動・再実行時間の計測")
+    parser.add_argument("--app", nargs="+", default=["app.py"], help="比較する app.py（複数指定可）")
+    parser.add_argument("--processes", type=int, default=3, help="app ごとに起動するプロセス数")
+    parser.add_argument("--reruns", type=int, default=10)
+    parser.add_argument("--user", default="Imugenos")
+    parser.add_argument("--json", help="結果をJSONで書き出すパス")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(measure(args.child, args.reruns, args.user)))
+        return 0
+
+    report = {}
+    for app in args.app:
+        with tempfile.TemporaryDirectory() as workdir:
+            for name in ASSETS:
+                shutil.copy(os.path.join(REPO_ROOT, name), workdir)
+            shutil.copy(app, os.path.join(workdir, "app.py"))
+            # 1回目はFAQ埋め込みストアの作成を含むため計測から除く
+            run_child("app.py", workdir, 1, args.user)
+            samples = [run_child("app.py", workdir, args.reruns, args.user) for _ in range(args.processes)]
+        report[app] = summarize(samples)
+
+    print(f"{'app':<30} {'login':>9} {'1st chat':>9} {'rerun p50':>10} {'rerun p95':>10}  heavy modules")
+    for app, r in report.items():
+        print(
+            f"{app:<30} {r['login_page_ms']:>7.0f}ms {r['first_chat_page_ms']:>7.0f}ms "
+            f"{r['rerun_p50_ms']:>8.1f}ms {r['rerun_p95_ms']:>8.1f}ms  {', '.join(r['heavy_modules']) or '-'}"
+        )
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class AdmissionRejected(RuntimeError):
+    pass
+
+
+class _Waiter:
+    def __init__(self, tenant):
+        self.tenant = tenant
+        self.admitted = False
+        self.enqueued = time.perf_counter()
+
+
+class _Endpoint:
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        # テナントごとの待ち行列（先頭のテナントから順に1件ずつ通す）
+        self.queues = OrderedDict()
+        self.queued = 0
+        self.max_queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.waits = deque(maxlen=1000)
+
+
+# --- OpenAI 呼び出しの同時実行数制限と待ち行列 ---
+# エンドポイント（"embedding" / "chat" など）ごとに同時実行数を limits で制限し、
+# 超えた分は max_queue 件まで待たせる。待ち行列はテナント（ログインID）ごとに分け、
+# テナント間で順番に通すことで、1テナントの集中が他のテナントを待たせ続けないようにする。
+class AdmissionController:
+    def __init__(self, limits, max_queue=64, max_wait=60.0, notify_interval=0.5):
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.notify_interval = notify_interval
+        self._cond = threading.Condition()
+        self._endpoints = {name: _Endpoint(limit) for name, limit in limits.items()}
+
+    @contextmanager
+    def slot(self, endpoint, tenant=None, on_wait=None):
+        # on_wait(順番) は待っている間、順番が変わるたびに呼ばれる（1始まり）
+        waited = self.acquire(endpoint, tenant, on_wait)
+        try:
+            yield waited
+        finally:
+            self.release(endpoint)
+
+    def acquire(self, endpoint, tenant=None, on_wait=None):
+        ep = self._endpoints[endpoint]
+        tenant = tenant or "default"
+        with self._cond:
+            if ep.in_flight < ep.limit and ep.queued == 0:
+                ep.in_flight += 1
+                ep.admitted += 1
+                ep.waits.append(0.0)
+                return 0.0
+            if ep.queued >= self.max_queue:
+                ep.rejected += 1
+                raise AdmissionRejected(f"{endpoint} の待ち行列が上限（{self.max_queue}件）に達しました")
+            waiter = _Waiter(tenant)
+            ep.queues.setdefault(tenant, deque()).append(waiter)
+            ep.queued += 1
+            ep.max_queued = max(ep.max_queued, ep.queued)
+            try:
+                self._wait(ep, waiter, endpoint, on_wait)
+            except BaseException:
+                # 待機中の中断（画面の再実行など）では、順番や確保済みの枠を残さない
+                if waiter.admitted:
+                    ep.in_flight -= 1
+                    self._dispatch(ep)
+                    self._cond.notify_all()
+                elif waiter in ep.queues.get(tenant, ()):
+                    self._remove(ep, waiter)
+                raise
+            waited = time.perf_counter() - waiter.enqueued
+            ep.waits.append(waited)
+            return waited
+
+    def _wait(self, ep, waiter, endpoint, on_wait):
+        deadline = waiter.enqueued + self.max_wait
+        last_position = None
+        while not waiter.admitted:
+            position = self._position(ep, waiter)
+            if on_wait is not None and position != last_position:
+                # 待機中は順番の通知だけ行い、ロックは手放して描画する
+                self._cond.release()
+                try:
+                    on_wait(position)
+                finally:
+                    self._cond.acquire()
+                last_position = position
+                continue
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                self._remove(ep, waiter)
+                ep.rejected += 1
+                raise AdmissionRejected(f"{endpoint} の待ち時間が上限（{self.max_wait:g}秒）を超えました")
+            self._cond.wait(min(remaining, self.notify_interval))
+
+    def release(self, endpoint):
+        ep = self._endpoints[endpoint]
+        with self._cond:
+            ep.in_flight -= 1
+            self._dispatch(ep)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            stats = {}
+            for name, ep in self._endpoints.items():
+                waits = np.array(ep.waits) * 1000 if ep.waits else np.zeros(1)
+                stats[name] = {
+                    "limit": ep.limit,
+                    "in_flight": ep.in_flight,
+                    "queued": ep.queued,
+                    "max_queued": ep.max_queued,
+                    "admitted": ep.admitted,
+                    "rejected": ep.rejected,
+                    "wait_p50_ms": float(np.percentile(waits, 50)),
+                    "wait_p95_ms": float(np.percentile(waits, 95)),
+                    "wait_max_ms": float(waits.max()),
+                    "queued_by_tenant": {t: len(q) for t, q in ep.queues.items()},
+                }
+            return stats
+
+    def _dispatch(self, ep):
+        # 空きがある限り、待ち行列の先頭テナントから1件ずつ通してテナントを末尾へ回す
+        while ep.in_flight < ep.limit and ep.queues:
+            tenant, queue = next(iter(ep.queues.items()))
+            waiter = queue.popleft()
+            if queue:
+                ep.queues.move_to_end(tenant)
+            else:
+                del ep.queues[tenant]
+            ep.queued -= 1
+            ep.in_flight += 1
+            ep.admitted += 1
+            waiter.admitted = True
+
+    def _position(self, ep, waiter):
+        # 巡回順で自分より先に通る件数 + 1（概算）
+        queue = ep.queues[waiter.tenant]
+        rank = queue.index(waiter)
+        position = 1
+        for tenant, q in ep.queues.items():
+            if tenant == waiter.tenant:
+                position += rank
+            else:
+                position += min(len(q), rank + (1 if self._before(ep, tenant, waiter.tenant) else 0))
+        return position
+
+    @staticmethod
+    def _before(ep, tenant, other):
+        for t in ep.queues:
+            if t == tenant:
+                return True
+            if t == other:
+                return False
+        return False
+
+    def _remove(self, ep, waiter):
+        queue = ep.queues[waiter.tenant]
+        queue.remove(waiter)
+        if not queue:
+            del ep.queues[waiter.tenant]
+        ep.queued -= 1
@@ -0,0 +1,85 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+Entry = namedtuple("Entry", ["bucket", "vector", "answer", "created"])
+
+
+def content_id(*parts):
+    return hashlib.sha256("\x1f".join(str(p) for p in parts).encode("utf-8")).hexdigest()[:16]
+
+
+# FAQ行の内容・言語・プロンプトのいずれかが変われば別のキーになり、古い回答は使われない
+def answer_bucket(ref_q, ref_a, lang, prompt_version):
+    return (content_id(ref_q, ref_a), lang, prompt_version)
+
+
+# --- 意味的な回答キャッシュ ---
+# 同じFAQ行に対する質問で、埋め込みのコサイン類似度が radius 以上なら生成済みの回答を返す。
+class AnswerCache:
+    def __init__(self, radius=0.95, max_entries=2000, ttl=7 * 24 * 3600):
+        self.radius = radius
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._buckets = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, bucket, q_vec):
+        q = _unit(q_vec)
+        now = time.time()
+        with self._lock:
+            best_id, best_sim = None, self.radius
+            for entry_id in list(self._buckets.get(bucket, ())):
+                entry = self._entries[entry_id]
+                if now - entry.created > self.ttl:
+                    self._remove(entry_id)
+                    continue
+                sim = float(entry.vector @ q)
+                if sim >= best_sim:
+                    best_id, best_sim = entry_id, sim
+            if best_id is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self._stats["hits"] += 1
+            return self._entries[best_id].answer
+
+    def put(self, bucket, q_vec, answer):
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = Entry(bucket, _unit(q_vec), answer, time.time())
+            self._buckets.setdefault(bucket, []).append(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        ids = self._buckets[entry.bucket]
+        ids.remove(entry_id)
+        if not ids:
+            del self._buckets[entry.bucket]
+
+
+def _unit(vec):
+    vec = np.asarray(vec, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm > 0 else vec
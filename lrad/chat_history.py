@@ -0,0 +1,177 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+# 回答前に次の質問が来て閉じたターンの回答
+INTERRUPTED_ANSWER = "（回答の生成が中断されました）"
+
+
+# --- 画面から外れた会話の保存先（全セッション共有の SQLite） ---
+# 1ターン（質問と回答）を JSON にして zlib で圧縮し、セッションIDと通し番号で保存する。
+# 最終更新から ttl を過ぎたターンと、セッションごとに max_turns を超えた古いターンは削除する。
+class ChatHistoryStore:
+    def __init__(self, path=".lrad_cache/chat_history.sqlite3", ttl=7 * 24 * 3600, max_turns=1000,
+                 evict_every=100):
+        self.path = path
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self.evict_every = evict_every
+        self._puts = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chat_turns ("
+            " session TEXT NOT NULL, seq INTEGER NOT NULL, turn BLOB NOT NULL, created REAL NOT NULL,"
+            " PRIMARY KEY (session, seq))"
+        )
+        self._conn.commit()
+
+    def put_many(self, session, turns):
+        # turns: [(通し番号, 質問, 回答), ...]
+        now = time.time()
+        rows = [(session, seq, _pack(q, a), now) for seq, q, a in turns]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chat_turns (session, seq, turn, created) VALUES (?, ?, ?, ?)", rows
+            )
+            self._conn.execute(
+                "DELETE FROM chat_turns WHERE session = ? AND seq <= "
+                "(SELECT MAX(seq) FROM chat_turns WHERE session = ?) - ?",
+                (session, session, self.max_turns),
+            )
+            self._puts += 1
+            if self._puts % self.evict_every == 0:
+                self._evict()
+            self._conn.commit()
+
+    def page(self, session, before, limit):
+        # 通し番号が before より前のターンを、新しい方から limit 件まで古い順に返す
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, turn FROM chat_turns WHERE session = ? AND seq < ? AND created >= ?"
+                " ORDER BY seq DESC LIMIT ?",
+                (session, before, time.time() - self.ttl, limit),
+            ).fetchall()
+        return [(seq, *_unpack(blob)) for seq, blob in reversed(rows)]
+
+    def count(self, session):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM chat_turns WHERE session = ? AND created >= ?",
+                (session, time.time() - self.ttl),
+            ).fetchone()[0]
+
+    def delete(self, session):
+        with self._lock:
+            self._conn.execute("DELETE FROM chat_turns WHERE session = ?", (session,))
+            self._conn.commit()
+
+    def evict(self):
+        with self._lock:
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        self._conn.execute("DELETE FROM chat_turns WHERE created < ?", (time.time() - self.ttl,))
+
+
+def _pack(q, a):
+    return zlib.compress(json.dumps([q, a], ensure_ascii=False).encode("utf-8"))
+
+
+def _unpack(blob):
+    q, a = json.loads(zlib.decompress(blob).decode("utf-8"))
+    return q, a
+
+
+def _turn_bytes(q, a):
+    return len(q.encode("utf-8")) + len((a or "").encode("utf-8"))
+
+
+# --- セッションごとの会話履歴 ---
+# 直近のターンだけをセッション内に持ち、max_memory_turns 件または max_memory_bytes（文字列のバイト数）を
+# 超えたら古いターンから store へ移す。store が無い場合は古いターンを捨てる。
+# 回答待ちのターン（最後のターンで answer が None）は移さない。回答待ちのまま次の質問が来たら、
+# そのターンは INTERRUPTED_ANSWER で閉じる。
+class ChatHistory:
+    def __init__(self, session, store=None, max_memory_turns=50, max_memory_bytes=256 * 1024):
+        self.session = session
+        self.store = store
+        self.max_memory_turns = max_memory_turns
+        self.max_memory_bytes = max_memory_bytes
+        self.turns = []  # [[通し番号, 質問, 回答], ...]
+        self.memory_bytes = 0
+        self.next_seq = 0
+        self.spilled = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self.spilled + self.dropped + len(self.turns)
+
+    @property
+    def pending(self):
+        # 回答待ちの質問（無ければ None）
+        if self.turns and self.turns[-1][2] is None:
+            return self.turns[-1][1]
+        return None
+
+    def ask(self, question):
+        if self.pending is not None:
+            self.answer(INTERRUPTED_ANSWER)
+        self.turns.append([self.next_seq, question, None])
+        self.next_seq += 1
+        self.memory_bytes += _turn_bytes(question, None)
+        self._spill()
+
+    def answer(self, answer):
+        turn = self.turns[-1]
+        self.memory_bytes += _turn_bytes("", answer) - _turn_bytes("", turn[2])
+        turn[2] = answer
+        self._spill()
+
+    def window(self, n_turns):
+        # 直近 n_turns 件の [(質問, 回答), ...] と、それより前のターンがあるかを返す
+        recent = self.turns[-n_turns:] if n_turns > 0 else []
+        need = n_turns - len(recent)
+        if need <= 0 or self.store is None or not self.spilled:
+            has_earlier = len(self.turns) > len(recent) or (self.store is not None and self.spilled > 0)
+            return [(q, a) for _, q, a in recent], has_earlier
+        before = recent[0][0] if recent else self.next_seq
+        earlier = self.store.page(self.session, before, need + 1)
+        has_earlier = len(earlier) > need
+        earlier = earlier[-need:]
+        return [(q, a) for _, q, a in earlier] + [(q, a) for _, q, a in recent], has_earlier
+
+    def stats(self):
+        return {
+            "turns": len(self),
+            "memory_turns": len(self.turns),
+            "memory_bytes": self.memory_bytes,
+            "spilled": self.spilled,
+            "dropped": self.dropped,
+        }
+
+    def _spill(self):
+        n = 0
+        bytes_out = 0
+        last = len(self.turns) - 1
+        while n < len(self.turns) and (n < last or self.turns[n][2] is not None) and (
+            len(self.turns) - n > self.max_memory_turns or self.memory_bytes - bytes_out > self.max_memory_bytes
+        ):
+            bytes_out += _turn_bytes(self.turns[n][1], self.turns[n][2])
+            n += 1
+        if not n:
+            return
+        moved = self.turns[:n]
+        if self.store is not None:
+            self.store.put_many(self.session, [tuple(t) for t in moved])
+            self.spilled += n
+        else:
+            self.dropped += n
+        del self.turns[:n]
+        self.memory_bytes -= bytes_out
@@ -0,0 +1,142 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import openai
+
+DEFAULT_MODEL = "text-embedding-3-small"
+
+
+class EmbeddingError(RuntimeError):
+    pass
+
+
+# --- トークンバケット方式のレート制限 ---
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1.0):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def is_retryable(e):
+    if isinstance(e, (openai.APIConnectionError, openai.APITimeoutError, openai.RateLimitError)):
+        return True
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code == 429 or e.status_code >= 500
+    return False
+
+
+def retry_after(e):
+    response = getattr(e, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+# --- 共有埋め込みクライアント ---
+# 入力をまとめてバッチ化し、上限付きスレッドプールで並列に送信する。
+# 失敗時はゼロベクトルを返さず EmbeddingError を送出する。
+# dimensions を指定すると短いベクトル（text-embedding-3 系のみ）を要求する。
+class EmbeddingClient:
+    def __init__(self, client=None, model=DEFAULT_MODEL, batch_size=512, max_batch_chars=200_000,
+                 max_workers=4, max_retries=5, base_delay=0.5, max_delay=20.0,
+                 requests_per_second=20.0, dimensions=None):
+        self.client = client if client is not None else openai
+        self.model = model
+        self.dimensions = dimensions
+        self.batch_size = batch_size
+        self.max_batch_chars = max_batch_chars
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate_limiter = TokenBucket(requests_per_second)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="embedding")
+        self._stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "retries": 0, "failures": 0, "texts": 0}
+
+    @property
+    def cache_key(self):
+        # キャッシュやストアのキーに使うモデル名（次元数が違うベクトルを混同しない）
+        return f"{self.model}:{self.dimensions}" if self.dimensions else self.model
+
+    def embed(self, texts):
+        texts = [clean_text(t) for t in texts]
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+
+        # 同一テキストは一度だけ送る
+        unique = list(dict.fromkeys(texts))
+        batches = list(self._pack(unique))
+        futures = [self._executor.submit(self._embed_batch, batch) for batch in batches]
+        vectors = {}
+        for batch, future in zip(batches, futures):
+            vectors.update(zip(batch, future.result()))
+        return np.stack([vectors[t] for t in texts])
+
+    def embed_one(self, text):
+        return self.embed([text])[0]
+
+    def _pack(self, texts):
+        batch, chars = [], 0
+        for t in texts:
+            if batch and (len(batch) >= self.batch_size or chars + len(t) > self.max_batch_chars):
+                yield batch
+                batch, chars = [], 0
+            batch.append(t)
+            chars += len(t)
+        if batch:
+            yield batch
+
+    def _embed_batch(self, batch):
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            self._count("requests")
+            try:
+                kwargs = {"dimensions": self.dimensions} if self.dimensions else {}
+                res = self.client.embeddings.create(input=batch, model=self.model, **kwargs)
+            except Exception as e:
+                if not is_retryable(e) or attempt == self.max_retries:
+                    self._count("failures")
+                    raise EmbeddingError(f"埋め込み取得に失敗しました（{len(batch)}件）: {e}") from e
+                self._count("retries")
+                delay = retry_after(e)
+                if delay is None:
+                    delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                time.sleep(delay)
+                continue
+            data = sorted(res.data, key=lambda d: d.index)
+            if len(data) != len(batch):
+                self._count("failures")
+                raise EmbeddingError(f"埋め込みの件数が一致しません: {len(data)} != {len(batch)}")
+            self._count("texts", len(batch))
+            return [np.asarray(d.embedding, dtype=np.float32) for d in data]
+
+    def _count(self, key, n=1):
+        with self._stats_lock:
+            self.stats[key] += n
+
+
+def clean_text(text):
+    text = str(text).replace("\n", " ")
+    # 空文字は API がエラーを返すため空白1文字に置き換える
+    return text if text.strip() else " "
@@ -0,0 +1,98 @@
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+# dense / lexical はハイブリッド検索時の内訳（密ベクトルの類似度と n-gram 一致率）
+SearchHit = namedtuple(
+    "SearchHit", ["position", "score", "question", "answer", "dense", "lexical"], defaults=(None, None)
+)
+
+
+def l2_normalize(matrix):
+    matrix = np.array(matrix, dtype=np.float32, copy=True, order="C", ndmin=2)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+
+# --- ベクトルの量子化 ---
+# float16 はそのまま半精度に、int8 は行ごとのスケール（最大絶対値 / 127）で丸める。
+PRECISIONS = ("float32", "float16", "int8")
+
+
+def quantize(matrix, precision):
+    if precision == "float32":
+        return matrix, None
+    if precision == "float16":
+        return matrix.astype(np.float16), None
+    if precision == "int8":
+        scale = np.abs(matrix).max(axis=1) / 127.0
+        scale[scale == 0] = 1.0
+        data = np.rint(matrix / scale[:, None]).astype(np.int8)
+        return data, scale.astype(np.float32)
+    raise ValueError(f"未対応の精度です: {precision}（{', '.join(PRECISIONS)} のいずれか）")
+
+
+# --- FAQ ベクトルインデックス ---
+# コーパスごとに一度だけ正規化済みの行列を作り、内積でスコアを計算する。
+# precision が float16 / int8 の場合は量子化した行列で近似スコアを計算し、
+# rerank > 0 なら上位候補だけを元の float32 ベクトル（ディスク上の mmap）で計算し直す。
+class FaqIndex:
+    def __init__(self, df, vectors, precision="float32", rerank=0, block_rows=4096):
+        self.questions = df["質問"].tolist()
+        self.answers = df["回答"].tolist()
+        self.precision = precision
+        self.rerank = rerank
+        self.block_rows = block_rows
+        self.matrix, self.scale = quantize(l2_normalize(vectors), precision)
+        self._full = vectors if precision != "float32" and rerank > 0 else None
+        if len(self.questions) != self.matrix.shape[0]:
+            raise ValueError(f"FAQの行数とベクトル数が一致しません: {len(self.questions)} != {self.matrix.shape[0]}")
+
+    @classmethod
+    def from_snapshot(cls, snapshot, precision="float32", rerank=0):
+        return cls(snapshot.df, snapshot.vectors, precision=precision, rerank=rerank)
+
+    def __len__(self):
+        return len(self.questions)
+
+    @property
+    def nbytes(self):
+        # 行列と質問・回答文字列のおおよそのメモリ使用量（mmap の元ベクトルは含まない）
+        scale = self.scale.nbytes if self.scale is not None else 0
+        return self.matrix.nbytes + scale + sum(sys.getsizeof(t) for t in self.questions + self.answers)
+
+    def scores(self, q_vec):
+        q = l2_normalize(q_vec)[0]
+        if self.precision == "float32":
+            return self.matrix @ q
+        scores = np.empty(len(self), dtype=np.float32)
+        # 一時的な float32 への展開はブロック単位に抑える
+        for start in range(0, len(self), self.block_rows):
+            block = self.matrix[start:start + self.block_rows]
+            scores[start:start + len(block)] = block.astype(np.float32) @ q
+        if self.scale is not None:
+            scores *= self.scale
+        if self._full is not None:
+            k = min(self.rerank, len(scores))
+            # mmap を前から順に読むよう行番号順で取り出す
+            top = np.sort(np.argpartition(-scores, k - 1)[:k])
+            scores[top] = l2_normalize(self._full[top]) @ q
+        return scores
+
+    def search(self, q_vec, k=1, min_score=None):
+        if len(self) == 0:
+            return []
+        scores = self.scores(q_vec)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        hits = [self.hit(int(i), float(scores[i])) for i in top]
+        if min_score is not None:
+            hits = [h for h in hits if h.score >= min_score]
+        return hits
+
+    def hit(self, position, score):
+        return SearchHit(position, score, self.questions[position], self.answers[position], dense=score)
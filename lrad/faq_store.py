@@ -0,0 +1,209 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+FAQ_COLUMNS = ["質問", "回答"]
+CURRENT_FILE = "CURRENT"
+
+
+# --- キー計算 ---
+def text_key(text, model):
+    return hashlib.sha256(f"{model}\n{text}".encode("utf-8")).hexdigest()
+
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def read_faq_csv(path):
+    # faq_all.csv は空列が大量にあるため必要な列だけ読む
+    df = pd.read_csv(path, usecols=FAQ_COLUMNS)
+    df = df.dropna(subset=["質問"]).reset_index(drop=True)
+    df["質問"] = df["質問"].astype(str)
+    df["回答"] = df["回答"].fillna("").astype(str)
+    return df
+
+
+# --- 読み取り専用のスナップショット ---
+class FaqSnapshot:
+    def __init__(self, df, vectors, manifest):
+        self.vectors = vectors
+        self.manifest = manifest
+        self.df = df
+
+    @property
+    def version(self):
+        return self.manifest["version"]
+
+    @property
+    def source_digest(self):
+        return self.manifest["source_digest"]
+
+
+# --- ディスク上の埋め込みストア ---
+# <root>/<CSV名>/<version>/ に vectors.npy と manifest.json を置き、
+# CURRENT ファイルの置き換えで新しいバージョンへ切り替える。
+class FaqEmbeddingStore:
+    def __init__(self, csv_path, embed_fn, model="text-embedding-3-small",
+                 root=".lrad_cache/faq_store", keep_versions=2):
+        self.csv_path = csv_path
+        self.embed_fn = embed_fn
+        self.model = model
+        self.root = os.path.join(root, os.path.splitext(os.path.basename(csv_path))[0])
+        self.keep_versions = keep_versions
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._csv_stat = None
+        self._rebuild_thread = None
+
+    def snapshot(self):
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = self._load_current()
+                if self._snapshot is None:
+                    # 初回のみ同期的に構築する
+                    self._snapshot = self._build(None)
+                    self._csv_stat = self._stat()
+                elif self._csv_changed():
+                    # 停止中に CSV が更新されていた場合も、保存済みのベクトルを再利用して作り直す
+                    self._start_rebuild()
+            elif self._csv_changed():
+                self._start_rebuild()
+            return self._snapshot
+
+    def is_rebuilding(self):
+        return self._rebuild_thread is not None and self._rebuild_thread.is_alive()
+
+    def rebuild(self):
+        # 同期的に再構築して差し替える（管理用）
+        snapshot = self._build(self._snapshot)
+        with self._lock:
+            self._snapshot = snapshot
+        return snapshot
+
+    def _stat(self):
+        st = os.stat(self.csv_path)
+        return (st.st_mtime_ns, st.st_size)
+
+    def _csv_changed(self):
+        try:
+            stat = self._stat()
+        except OSError:
+            return False
+        if stat == self._csv_stat:
+            return False
+        self._csv_stat = stat
+        return file_digest(self.csv_path) != self._snapshot.source_digest
+
+    def _start_rebuild(self):
+        if self.is_rebuilding():
+            return
+        self._rebuild_thread = threading.Thread(target=self._rebuild_in_background, daemon=True)
+        self._rebuild_thread.start()
+
+    def _rebuild_in_background(self):
+        try:
+            snapshot = self._build(self._snapshot)
+        except Exception as e:
+            # 失敗しても実行中のセッションは旧スナップショットのまま応答を続ける
+            self.last_error = e
+            with self._lock:
+                self._csv_stat = None
+            return
+        with self._lock:
+            self._snapshot = snapshot
+            self.last_error = None
+
+    def _load_current(self):
+        try:
+            with open(os.path.join(self.root, CURRENT_FILE), encoding="utf-8") as f:
+                version = f.read().strip()
+            version_dir = os.path.join(self.root, version)
+            with open(os.path.join(version_dir, "manifest.json"), encoding="utf-8") as f:
+                manifest = json.load(f)
+            vectors = np.load(os.path.join(version_dir, "vectors.npy"), mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        if manifest.get("model") != self.model:
+            return None
+        df = pd.DataFrame({"質問": manifest["questions"], "回答": manifest["answers"]})
+        return FaqSnapshot(df, vectors, manifest)
+
+    def _build(self, previous):
+        source_digest = file_digest(self.csv_path)
+        df = read_faq_csv(self.csv_path)
+        keys = [text_key(q, self.model) for q in df["質問"]]
+
+        # 既存ベクトルを再利用し、追加・変更された質問だけを埋め込む
+        known = {}
+        if previous is not None:
+            for i, key in enumerate(previous.manifest["keys"]):
+                known[key] = previous.vectors[i]
+        missing = {}
+        for key, q in zip(keys, df["質問"]):
+            if key not in known and key not in missing:
+                missing[key] = q
+        if missing:
+            embedded = self.embed_fn(list(missing.values()))
+            for key, vec in zip(missing.keys(), embedded):
+                known[key] = np.asarray(vec, dtype=np.float32)
+
+        dim = len(known[keys[0]]) if keys else 0
+        vectors = np.empty((len(keys), dim), dtype=np.float32)
+        for i, key in enumerate(keys):
+            vectors[i] = known[key]
+
+        version = f"{int(time.time())}-{source_digest[:12]}"
+        manifest = {
+            "version": version,
+            "model": self.model,
+            "dim": dim,
+            "source_digest": source_digest,
+            "keys": keys,
+            "questions": df["質問"].tolist(),
+            "answers": df["回答"].tolist(),
+            "reused": len(keys) - len(missing),
+            "embedded": len(missing),
+        }
+        self._write_version(version, vectors, manifest)
+        vectors = np.load(os.path.join(self.root, version, "vectors.npy"), mmap_mode="r")
+        return FaqSnapshot(df, vectors, manifest)
+
+    def _write_version(self, version, vectors, manifest):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_dir = os.path.join(self.root, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(tmp_dir)
+        np.save(os.path.join(tmp_dir, "vectors.npy"), vectors)
+        with open(os.path.join(tmp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        version_dir = os.path.join(self.root, version)
+        if os.path.exists(version_dir):
+            shutil.rmtree(version_dir)
+        os.replace(tmp_dir, version_dir)
+
+        tmp_current = os.path.join(self.root, f".{CURRENT_FILE}-{uuid.uuid4().hex}")
+        with open(tmp_current, "w", encoding="utf-8") as f:
+            f.write(version)
+        os.replace(tmp_current, os.path.join(self.root, CURRENT_FILE))
+        self._prune(version)
+
+    def _prune(self, current):
+        versions = sorted(
+            d for d in os.listdir(self.root)
+            if not d.startswith(".") and os.path.isdir(os.path.join(self.root, d))
+        )
+        stale = [v for v in versions if v != current][:-(self.keep_versions - 1) or None]
+        for v in stale:
+            shutil.rmtree(os.path.join(self.root, v), ignore_errors=True)
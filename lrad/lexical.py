@@ -0,0 +1,82 @@
+import math
+import sys
+from collections import Counter
+
+import numpy as np
+
+from lrad.query_cache import normalize_query
+
+
+# --- 文字 n-gram（日本語は分かち書き不要） ---
+def compact_text(text):
+    # 空白・記号を除いて小文字化した比較用の文字列
+    return "".join(c for c in normalize_query(text).lower() if c.isalnum())
+
+
+def char_ngrams(text, sizes=(2, 3)):
+    text = compact_text(text)
+    grams = []
+    for n in sizes:
+        grams.extend(text[i:i + n] for i in range(len(text) - n + 1))
+    if not grams and text:
+        grams.append(text)
+    return grams
+
+
+# --- BM25 転置インデックス ---
+class Bm25Index:
+    def __init__(self, texts, sizes=(2, 3), k1=1.2, b=0.75):
+        self.sizes = sizes
+        docs = [Counter(char_ngrams(t, sizes)) for t in texts]
+        self.doc_sets = [set(d) for d in docs]
+        self.size = len(docs)
+        lengths = np.array([sum(d.values()) for d in docs], dtype=np.float32)
+        avgdl = float(lengths.mean()) if self.size and lengths.mean() > 0 else 1.0
+
+        postings = {}
+        for doc_id, terms in enumerate(docs):
+            for term, tf in terms.items():
+                postings.setdefault(term, []).append((doc_id, tf))
+
+        # 文書ごとの重み（idf × tf 飽和項）を事前計算しておく
+        self.postings = {}
+        self.idf = {}
+        # コーパスに無い n-gram の idf（どの文書にも出てこない語として扱う）
+        self.unseen_idf = math.log(1 + (self.size + 0.5) / 0.5)
+        for term, entries in postings.items():
+            ids = np.array([e[0] for e in entries], dtype=np.int32)
+            tfs = np.array([e[1] for e in entries], dtype=np.float32)
+            idf = math.log(1 + (self.size - len(entries) + 0.5) / (len(entries) + 0.5))
+            self.idf[term] = idf
+            norm = k1 * (1 - b + b * lengths[ids] / avgdl)
+            self.postings[term] = (ids, (idf * tfs * (k1 + 1) / (tfs + norm)).astype(np.float32))
+
+    @property
+    def nbytes(self):
+        # 転置リストの配列と n-gram 文字列・辞書のおおよそのメモリ使用量
+        postings = sum(ids.nbytes + w.nbytes + sys.getsizeof(term) + 200 for term, (ids, w) in self.postings.items())
+        doc_sets = sum(sys.getsizeof(d) for d in self.doc_sets)
+        return postings + doc_sets + sys.getsizeof(self.postings)
+
+    def scores(self, query):
+        scores = np.zeros(self.size, dtype=np.float32)
+        for term, qtf in Counter(char_ngrams(query, self.sizes)).items():
+            posting = self.postings.get(term)
+            if posting is not None:
+                ids, weights = posting
+                scores[ids] += qtf * weights
+        return scores
+
+    def self_score(self, query):
+        # クエリ自身を平均的な長さの文書とみなしたときの BM25（語彙一致の上限の目安）。
+        # コーパスに無い n-gram も含めるので、一部の語尾だけが一致する文書は低いままになる
+        return sum(qtf * self.idf.get(term, self.unseen_idf)
+                   for term, qtf in Counter(char_ngrams(query, self.sizes)).items())
+
+    def overlap(self, query, position):
+        # n-gram 集合の Dice 係数（ほぼ同文なら 1.0 に近い）
+        q = set(char_ngrams(query, self.sizes))
+        d = self.doc_sets[position]
+        if not q or not d:
+            return 0.0
+        return 2 * len(q & d) / (len(q) + len(d))
@@ -0,0 +1,296 @@
+import atexit
+import csv
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone, timedelta
+
+JST = timezone(timedelta(hours=9))
+LOG_COLUMNS = ["timestamp", "question", "answer"]
+# 1ターンの計測値（ChatPipeline の TurnResult.metrics()）。CSV ログにだけ追加列として書き込む
+STAGE_COLUMNS = ["queue_ms", "embedding_ms", "retrieval_ms", "ttft_ms", "generation_ms", "total_ms"]
+NUMERIC_METRIC_COLUMNS = STAGE_COLUMNS + ["similarity", "prompt_tokens", "completion_tokens"]
+METRIC_COLUMNS = ["route", "query_cache"] + NUMERIC_METRIC_COLUMNS
+CSV_LOG_COLUMNS = LOG_COLUMNS + METRIC_COLUMNS
+SHEETS_SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive",
+]
+
+
+# --- 書き込み先: ローカル CSV ---
+class CsvLogWriter:
+    def __init__(self, path="chat_logs.csv", columns=LOG_COLUMNS):
+        self.path = path
+        self.columns = list(columns)
+        self._header = None
+
+    def write(self, records):
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        if new_file:
+            self._header = list(self.columns)
+        elif self._header is None:
+            self._header = self._migrate_header()
+        with open(self.path, "a", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(self._header)
+            writer.writerows(self.row(r) for r in records)
+
+    def row(self, record):
+        timestamp = datetime.fromtimestamp(record["created"]).isoformat()
+        return [timestamp] + [record.get(c, "") for c in (self._header or self.columns)[1:]]
+
+    def _migrate_header(self):
+        # 既存ファイルに無い列が増えた場合は、既存の行を空欄で埋めて新しいヘッダーで書き直す
+        with open(self.path, newline="", encoding="utf-8-sig") as f:
+            rows = list(csv.reader(f))
+        header = rows[0] if rows else []
+        missing = [c for c in self.columns if c not in header]
+        if not missing:
+            return header
+        new_header = header + missing
+        tmp = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(new_header)
+            writer.writerows(r + [""] * (len(new_header) - len(r)) for r in rows[1:] if r)
+        os.replace(tmp, self.path)
+        return new_header
+
+
+# --- 書き込み先: Google Sheets（ユーザーIDごとのワークシート） ---
+# gspread クライアントとワークシートはプロセス内で使い回す
+class GoogleSheetsWriter:
+    def __init__(self, sheet_key, service_account_info, columns=LOG_COLUMNS):
+        if isinstance(service_account_info, str):
+            service_account_info = json.loads(service_account_info)
+        self.sheet_key = sheet_key
+        self.service_account_info = dict(service_account_info)
+        self.columns = columns
+        self._spreadsheet = None
+        self._worksheets = {}
+
+    def write(self, records):
+        by_user = {}
+        for r in records:
+            by_user.setdefault(r.get("user_id") or "default", []).append(self.row(r))
+        try:
+            for user_id, rows in by_user.items():
+                self._worksheet(user_id).append_rows(rows, value_input_option="USER_ENTERED")
+        except Exception:
+            # 認証切れなどに備えて次回は接続し直す
+            self._spreadsheet = None
+            self._worksheets.clear()
+            raise
+
+    def row(self, record):
+        timestamp = datetime.fromtimestamp(record["created"], JST).strftime("%Y-%m-%d %H:%M:%S")
+        return [timestamp] + [record.get(c, "") for c in self.columns[1:]]
+
+    def _worksheet(self, title):
+        import gspread
+
+        if title in self._worksheets:
+            return self._worksheets[title]
+        if self._spreadsheet is None:
+            from google.oauth2.service_account import Credentials
+
+            creds = Credentials.from_service_account_info(self.service_account_info, scopes=SHEETS_SCOPES)
+            self._spreadsheet = gspread.authorize(creds).open_by_key(self.sheet_key)
+        try:
+            worksheet = self._spreadsheet.worksheet(title)
+        except gspread.exceptions.WorksheetNotFound:
+            worksheet = self._spreadsheet.add_worksheet(title=title, rows="1000", cols=str(len(self.columns)))
+            worksheet.append_row(self.columns)
+        self._worksheets[title] = worksheet
+        return worksheet
+
+
+# --- バックグラウンドでまとめて書き込むログシンク ---
+# 未書き込みのレコードは spool（JSON Lines）に追記し、書き込み先の障害や
+# プロセス再起動があっても失われないようにする。書き込めた位置は <spool>.ack にバイト単位で記録し、
+# spool 自体は書き直さない（全件書き込めた時点で空にする）。メモリ上には max_buffered 件までしか
+# 持たず、障害中に溜まった分は spool から順に読み戻して送る。
+class BatchedLogSink:
+    def __init__(self, write_batch, spool_path, batch_size=50, flush_interval=2.0, max_backoff=60.0,
+                 max_buffered=1000):
+        self.write_batch = write_batch
+        self.spool_path = spool_path
+        self.ack_path = f"{spool_path}.ack"
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.max_buffered = max(max_buffered, batch_size)
+        self.last_error = None
+        self.stats = {"written": 0, "batches": 0, "failures": 0}
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        # (レコード, spool 上の行末の位置) を spool の順に先読みしておく
+        self._buffer = deque()
+        self._acked, self._end, self._count = self._open_spool()
+        self._read_pos = self._acked
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True, name="log-sink")
+        self._thread.start()
+
+    def put(self, record):
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._cond:
+            with open(self.spool_path, "ab") as f:
+                f.write(line)
+            caught_up = self._read_pos == self._end
+            self._end += len(line)
+            self._count += 1
+            # spool に未読の行が無く、上限内のときだけメモリにも載せる
+            if caught_up and len(self._buffer) < self.max_buffered:
+                self._buffer.append((record, self._end))
+                self._read_pos = self._end
+            if self._count >= self.batch_size:
+                self._cond.notify()
+
+    def pending(self):
+        with self._cond:
+            return self._count
+
+    def buffered(self):
+        with self._cond:
+            return len(self._buffer)
+
+    def flush(self):
+        # 未書き込みのレコードをすべて書き込む（失敗時は例外）
+        while self._flush_once():
+            pass
+
+    def close(self, timeout=10.0):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        try:
+            self.flush()
+        except Exception as e:
+            # 書けなかった分は spool に残り、次回起動時に再送される
+            self.last_error = e
+
+    def _run(self):
+        backoff = None
+        while True:
+            with self._cond:
+                if backoff is not None:
+                    # 書き込み失敗後は件数に関係なく待ってから再試行する
+                    self._cond.wait_for(lambda: self._closed, timeout=backoff)
+                elif self._count < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                if self._closed:
+                    return
+            try:
+                while self._flush_once():
+                    pass
+                backoff = None
+            except Exception:
+                backoff = min(self.max_backoff, (backoff or self.flush_interval) * 2)
+
+    def _flush_once(self):
+        with self._write_lock:
+            with self._cond:
+                if len(self._buffer) < self.batch_size:
+                    self._refill()
+                batch = [record for record, _ in itertools.islice(self._buffer, self.batch_size)]
+                if not batch:
+                    if self._acked != self._end and self._read_pos == self._end:
+                        # 読み飛ばした壊れた行だけが残っている
+                        self._ack(self._end)
+                    return False
+            try:
+                self.write_batch(batch)
+            except Exception as e:
+                self.last_error = e
+                self.stats["failures"] += 1
+                raise
+            with self._cond:
+                for _ in batch:
+                    _, offset = self._buffer.popleft()
+                self._count -= len(batch)
+                self._ack(offset)
+            self.last_error = None
+            self.stats["written"] += len(batch)
+            self.stats["batches"] += 1
+            return True
+
+    # --- spool の管理（呼び出し側で self._cond を保持する） ---
+    def _refill(self):
+        # メモリ上のレコードが少なくなったら、spool の未読部分から上限まで読み戻す
+        if self._read_pos >= self._end:
+            return
+        with open(self.spool_path, "rb") as f:
+            f.seek(self._read_pos)
+            while len(self._buffer) < self.max_buffered and self._read_pos < self._end:
+                line = f.readline()
+                if not line:
+                    break
+                self._read_pos += len(line)
+                try:
+                    self._buffer.append((json.loads(line), self._read_pos))
+                except ValueError:
+                    self._count -= 1
+
+    def _ack(self, offset):
+        self._acked = offset
+        if self._acked == self._end:
+            # すべて書き込めたら spool を空にする
+            with open(self.spool_path, "wb"):
+                pass
+            self._acked = self._read_pos = self._end = 0
+        tmp = f"{self.ack_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(str(self._acked))
+        os.replace(tmp, self.ack_path)
+
+    def _open_spool(self):
+        # (書き込み済みの位置, spool の末尾, 未書き込みの件数) を返す
+        os.makedirs(os.path.dirname(self.spool_path) or ".", exist_ok=True)
+        if not os.path.exists(self.spool_path):
+            open(self.spool_path, "wb").close()
+        size = os.path.getsize(self.spool_path)
+        try:
+            with open(self.ack_path, encoding="utf-8") as f:
+                acked = int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            acked = 0
+        if not 0 <= acked <= size:
+            acked = 0
+        count, end = 0, acked
+        with open(self.spool_path, "rb") as f:
+            f.seek(acked)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                end += len(line)
+                count += 1
+        if end != size:
+            # 書き込み途中で落ちた最終行は切り捨てる
+            with open(self.spool_path, "rb+") as f:
+                f.truncate(end)
+        return acked, end, count
+
+
+# --- 複数の書き込み先へ振り分けるログパイプライン ---
+class LogPipeline:
+    def __init__(self, sinks):
+        self.sinks = sinks
+        atexit.register(self.close)
+
+    def log(self, user_id, question, answer, **extra):
+        record = {"created": time.time(), "user_id": user_id, "question": question, "answer": answer}
+        record.update(extra)
+        for sink in self.sinks:
+            sink.put(record)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
@@ -0,0 +1,201 @@
+import csv
+import glob
+import io
+import json
+import os
+import re
+import threading
+import uuid
+
+import pandas as pd
+
+from lrad.log_sink import NUMERIC_METRIC_COLUMNS
+
+ROLLUP_FILE = "rollup_hourly.parquet"
+STATE_FILE = "state.json"
+
+
+# --- 月別パーティションの Parquet チャットログストア ---
+# chat_logs.csv の未取り込み部分だけを読み、<root>/month=YYYY-MM/part-*.parquet に追記する。
+# 日付×時間帯の件数集計（rollup）も同時に更新する。
+class ChatLogStore:
+    def __init__(self, root=".lrad_cache/chat_log_store", max_parts=16):
+        self.root = root
+        self.max_parts = max_parts
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self.state = self._load_state()
+
+    @property
+    def version(self):
+        # 取り込み直し（epoch）でも値が変わるよう、件数と組にする
+        return f"{self.state.get('epoch', 0)}-{self.state['rows']}"
+
+    @property
+    def columns(self):
+        return self.state["columns"]
+
+    # --- CSV からの差分取り込み ---
+    def sync_from_csv(self, path):
+        with self._lock:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                return 0
+            if (size < self.state["offset"] or self.state["source"] not in (None, os.path.abspath(path))
+                    or self._header_changed(path)):
+                # CSV が作り直された場合（列の追加を含む）は最初から取り込み直す
+                self._reset()
+            if size == self.state["offset"]:
+                return 0
+            with open(path, "rb") as f:
+                f.seek(self.state["offset"])
+                chunk = f.read(size - self.state["offset"])
+            rows, consumed = self._parse(chunk)
+            if not rows and not consumed:
+                return 0
+            if self.state["columns"] is None:
+                self.state["columns"] = rows.pop(0)
+            added = self._append(rows)
+            self.state["offset"] += consumed
+            self.state["source"] = os.path.abspath(path)
+            self.state["rows"] += added
+            self._save_state()
+            return added
+
+    def _header_changed(self, path):
+        if self.state["columns"] is None:
+            return False
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            header = next(csv.reader(f), [])
+        return header != self.state["columns"]
+
+    def _parse(self, chunk):
+        # 引用符の数が偶数になる改行までを「書き込み済みの行」とみなして取り込む
+        # （引用符内の改行を含む回答や、書き込み途中の最終行に対応するため）
+        consumed, quotes = 0, 0
+        pos = 0
+        for line in re.findall(rb"[^\n]*\n", chunk):
+            pos += len(line)
+            quotes += line.count(b'"')
+            if quotes % 2 == 0:
+                consumed = pos
+        text = chunk[:consumed]
+        if self.state["offset"] == 0:
+            text = text.removeprefix(b"\xef\xbb\xbf")
+        rows = [r for r in csv.reader(io.StringIO(text.decode("utf-8", errors="replace"), newline="")) if r]
+        return rows, consumed
+
+    def _append(self, rows):
+        if not rows:
+            return 0
+        columns = self.state["columns"]
+        df = pd.DataFrame([r[:len(columns)] + [""] * (len(columns) - len(r)) for r in rows], columns=columns)
+        df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce", format="mixed")
+        for col in NUMERIC_METRIC_COLUMNS:
+            if col in df.columns:
+                df[col] = pd.to_numeric(df[col], errors="coerce")
+        df = df.dropna(subset=["timestamp"])
+        if df.empty:
+            return 0
+        months = df["timestamp"].dt.strftime("%Y-%m")
+        for month, part in df.groupby(months):
+            month_dir = os.path.join(self.root, f"month={month}")
+            os.makedirs(month_dir, exist_ok=True)
+            self._write_parquet(part, os.path.join(month_dir, f"part-{uuid.uuid4().hex}.parquet"))
+            self._compact(month_dir)
+        self._update_rollup(df)
+        return len(df)
+
+    def _compact(self, month_dir):
+        parts = sorted(glob.glob(os.path.join(month_dir, "part-*.parquet")))
+        if len(parts) <= self.max_parts:
+            return
+        merged = pd.concat([pd.read_parquet(p) for p in parts], ignore_index=True)
+        self._write_parquet(merged, os.path.join(month_dir, f"part-{uuid.uuid4().hex}.parquet"))
+        for p in parts:
+            os.remove(p)
+
+    def _update_rollup(self, df):
+        counts = (
+            pd.DataFrame({"date": df["timestamp"].dt.normalize(), "hour": df["timestamp"].dt.hour})
+            .value_counts()
+            .rename("count")
+            .reset_index()
+        )
+        path = os.path.join(self.root, ROLLUP_FILE)
+        if os.path.exists(path):
+            counts = pd.concat([pd.read_parquet(path), counts], ignore_index=True)
+            counts = counts.groupby(["date", "hour"], as_index=False)["count"].sum()
+        self._write_parquet(counts.sort_values(["date", "hour"]), path)
+
+    # --- 読み出し ---
+    def date_bounds(self):
+        rollup = self.rollup()
+        if rollup.empty:
+            return None, None
+        return rollup["date"].min().date(), rollup["date"].max().date()
+
+    def rollup(self, start_date=None, end_date=None):
+        path = os.path.join(self.root, ROLLUP_FILE)
+        if not os.path.exists(path):
+            return pd.DataFrame({"date": pd.Series(dtype="datetime64[ns]"), "hour": [], "count": []})
+        rollup = pd.read_parquet(path)
+        if start_date is not None:
+            rollup = rollup[rollup["date"] >= pd.Timestamp(start_date)]
+        if end_date is not None:
+            rollup = rollup[rollup["date"] <= pd.Timestamp(end_date)]
+        return rollup
+
+    def load(self, start_date, end_date, columns=None):
+        # 期間に重なる月のパーティションだけを読む
+        if columns is not None and "timestamp" not in columns:
+            columns = ["timestamp"] + list(columns)
+        months = pd.period_range(pd.Timestamp(start_date), pd.Timestamp(end_date), freq="M")
+        parts = []
+        for month in months.strftime("%Y-%m"):
+            parts.extend(sorted(glob.glob(os.path.join(self.root, f"month={month}", "part-*.parquet"))))
+        if not parts:
+            return self._empty(columns or self.columns or ["timestamp"])
+        df = pd.concat([pd.read_parquet(p, columns=columns) for p in parts], ignore_index=True)
+        dates = df["timestamp"].dt.date
+        return df[(dates >= start_date) & (dates <= end_date)].reset_index(drop=True)
+
+    @staticmethod
+    def _empty(columns):
+        # 該当する月が無い場合も、パーティションと同じ型の空の表を返す（.dt などがそのまま使える）
+        def dtype(col):
+            if col == "timestamp":
+                return "datetime64[ns]"
+            return "float64" if col in NUMERIC_METRIC_COLUMNS else "object"
+
+        return pd.DataFrame({col: pd.Series(dtype=dtype(col)) for col in columns})
+
+    # --- 状態の保存 ---
+    def _load_state(self):
+        try:
+            with open(os.path.join(self.root, STATE_FILE), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"offset": 0, "rows": 0, "columns": None, "source": None}
+
+    def _save_state(self):
+        tmp = os.path.join(self.root, f".{STATE_FILE}.{uuid.uuid4().hex}")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(self.root, STATE_FILE))
+
+    def _reset(self):
+        for path in glob.glob(os.path.join(self.root, "month=*", "part-*.parquet")):
+            os.remove(path)
+        rollup = os.path.join(self.root, ROLLUP_FILE)
+        if os.path.exists(rollup):
+            os.remove(rollup)
+        epoch = self.state.get("epoch", 0) + 1
+        self.state = {"offset": 0, "rows": 0, "columns": None, "source": None, "epoch": epoch}
+
+    @staticmethod
+    def _write_parquet(df, path):
+        tmp = f"{path}.tmp"
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, path)
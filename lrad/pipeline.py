@@ -0,0 +1,249 @@
+import time
+
+from lrad.admission import AdmissionRejected
+from lrad.answer_cache import answer_bucket, content_id
+from lrad.embedding_client import EmbeddingError
+from lrad.query_cache import normalize_query
+from lrad.retrieval import is_confident_hit
+from lrad.single_flight import SingleFlight
+from lrad.streaming import stream_chat_completion
+
+SYSTEM_PROMPT_TEMPLATE = (
+    "あなたはLRAD（遠赤外線電子熱分解装置）の専門家です。\n"
+    "LRADの導入実績はまだありません。\n"
+    "もし質問が「見積もり」や「問い合わせ先」に関するものであれば、必ず次のリンクを案内してください。ただし、URLの後ろに句読点は絶対付けないでください。：https://imugenos.com/pages\n"
+    "「お問合せ先」に関連しない質問には、URLを貼らないでください。\n"
+    "FAQ質問: {ref_q}\nFAQ回答: {ref_a}\n"
+    "この情報をもとに200文字以内で簡潔にユーザーの質問に答えてください。"
+)
+NO_MATCH_MESSAGE = "申し訳ありません、関連FAQが見つかりませんでした。"
+GENERATION_ERROR_MESSAGE = "申し訳ありません。回答の生成中にエラーが発生しました。"
+SEARCH_ERROR_MESSAGE = "申し訳ありません。質問の検索中にエラーが発生しました。しばらくしてからもう一度お試しください。"
+BUSY_MESSAGE = "ただいま混み合っています。しばらくしてからもう一度お試しください。"
+STAGES = ["queue", "embedding", "retrieval", "ttft", "generation", "total"]
+
+
+# --- 1ターン分の結果 ---
+# route: "exact" | "no_match" | "fast_path" | "answer_cache" | "generated" | "error" | "busy"
+class TurnResult:
+    def __init__(self, question):
+        self.question = question
+        self.answer = None
+        self.route = None
+        self.hits = []
+        self.q_vec = None
+        self.query_cache = None
+        self.timings = {}
+        self.usage = None
+        self.error = None
+        self.tenant = None
+        self.on_wait = None
+        # 他のセッションの同時呼び出しと結果を共有した段階（"generation" など）
+        self.coalesced = []
+
+    @property
+    def top_hit(self):
+        return self.hits[0] if self.hits else None
+
+    def metrics(self):
+        # ログの追加列（lrad.log_sink.METRIC_COLUMNS）に書き込む値。該当しない段階は空欄にする
+        row = {f"{stage}_ms": round(self.timings[stage] * 1000, 1) for stage in STAGES
+               if self.timings.get(stage) is not None}
+        row["route"] = self.route
+        row["query_cache"] = self.query_cache or ""
+        top = self.top_hit
+        if top is not None:
+            row["similarity"] = round(top.dense if top.dense is not None else top.score, 4)
+        if self.usage is not None:
+            row["prompt_tokens"] = self.usage.prompt_tokens
+            row["completion_tokens"] = self.usage.completion_tokens
+        return row
+
+
+# --- 検索から回答生成までの処理 ---
+# Streamlit に依存しないので、ベンチマークからも同じ処理を呼び出せる。
+class ChatPipeline:
+    def __init__(self, retriever, exact_answers, query_cache, answer_cache, chat_client,
+                 chat_model="gpt-3.5-turbo", prompt_template=SYSTEM_PROMPT_TEMPLATE, temperature=0.3,
+                 min_similarity=0.3, fast_path_lexical=0.8, fast_path_dense=0.85, single_flight=None,
+                 admission=None):
+        self.retriever = retriever
+        self.exact_answers = exact_answers
+        self.query_cache = query_cache
+        self.answer_cache = answer_cache
+        self.chat_client = chat_client
+        self.chat_model = chat_model
+        self.prompt_template = prompt_template
+        self.temperature = temperature
+        self.min_similarity = min_similarity
+        self.fast_path_lexical = fast_path_lexical
+        self.fast_path_dense = fast_path_dense
+        # 同じFAQ行への同じ質問が同時に来たら、回答生成は1回だけ行う
+        self.single_flight = single_flight if single_flight is not None else SingleFlight()
+        # OpenAI 呼び出しの同時実行数制限（AdmissionController）。None なら制限しない
+        self.admission = admission
+        # プロンプトやモデルを変更すると回答キャッシュは自動的に無効になる
+        self.prompt_version = content_id(prompt_template, chat_model)
+
+    def answer(self, question, lang, on_text=None, tenant=None, on_wait=None):
+        # on_wait(順番) は API 呼び出しの順番待ちをしている間に呼ばれる
+        result = TurnResult(question)
+        result.tenant, result.on_wait = tenant, on_wait
+        started = time.perf_counter()
+        try:
+            self._answer(result, lang, on_text)
+        except AdmissionRejected:
+            result.answer, result.route = BUSY_MESSAGE, "busy"
+        finally:
+            result.timings["total"] = time.perf_counter() - started
+        return result
+
+    def admitted(self, endpoint, result, fn):
+        # 同時実行数の枠を確保してから fn() を呼び、待ち時間を timings["queue"] に加える
+        if self.admission is None:
+            return fn()
+        with self.admission.slot(endpoint, result.tenant, result.on_wait) as waited:
+            result.timings["queue"] = result.timings.get("queue", 0.0) + waited
+            return fn()
+
+    def progress_handler(self, result, on_text=None):
+        # 共有する API 呼び出しの途中経過（("queue", 順番) / ("text", これまでの全文)）を、
+        # このセッションの on_wait / on_text に渡す。どちらも無ければ None
+        if result.on_wait is None and on_text is None:
+            return None
+
+        def handle(update):
+            kind, value = update
+            if kind == "queue" and result.on_wait is not None:
+                result.on_wait(value)
+            elif kind == "text" and on_text is not None:
+                on_text(value)
+
+        return handle
+
+    def retrieve(self, result, k=1):
+        # 埋め込みは他のセッションと共有する呼び出しになり得るため、順番待ちは publish で通知し
+        # 待ち時間は upstream に記録する（このセッションの表示は呼び出しの外で行う）
+        upstream = TurnResult(result.question)
+        upstream.tenant = result.tenant
+
+        def gate(fn, publish):
+            upstream.on_wait = lambda position: publish(("queue", position))
+            return self.admitted("embedding", upstream, fn)
+
+        t = time.perf_counter()
+        try:
+            result.q_vec, result.query_cache = self.query_cache.lookup(
+                result.question, gate=gate, on_progress=self.progress_handler(result)
+            )
+        except EmbeddingError as e:
+            result.error = str(e)
+            return []
+        finally:
+            queued = upstream.timings.get("queue")
+            if queued is not None:
+                result.timings["queue"] = result.timings.get("queue", 0.0) + queued
+            result.timings["embedding"] = time.perf_counter() - t - (queued or 0.0)
+        if result.query_cache == "coalesced":
+            result.coalesced.append("embedding")
+        t = time.perf_counter()
+        result.hits = self.retriever.search(result.question, result.q_vec, k=k, min_score=self.min_similarity)
+        result.timings["retrieval"] = time.perf_counter() - t
+        return result.hits
+
+    def build_messages(self, question, ref_q, ref_a):
+        system_prompt = self.prompt_template.format(ref_q=ref_q, ref_a=ref_a)
+        return [{"role": "system", "content": system_prompt}, {"role": "user", "content": question}]
+
+    def generate(self, result, ref_q, ref_a, on_text=None):
+        messages = self.build_messages(result.question, ref_q, ref_a)
+        t, queued = time.perf_counter(), result.timings.get("queue", 0.0)
+        try:
+            if on_text is not None:
+                stream = self.admitted("chat", result, lambda: stream_chat_completion(
+                    self.chat_client, on_text=on_text,
+                    model=self.chat_model, messages=messages, temperature=self.temperature,
+                ))
+                result.timings["ttft"] = stream.ttft
+                result.usage = stream.usage
+                answer = stream.text
+            else:
+                res = self.admitted("chat", result, lambda: self.chat_client.chat.completions.create(
+                    model=self.chat_model, messages=messages, temperature=self.temperature
+                ))
+                result.usage = getattr(res, "usage", None)
+                answer = res.choices[0].message.content.strip()
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            result.error = f"AI回答生成に失敗しました: {e}"
+            return None
+        finally:
+            # 順番待ちの時間は timings["queue"] に分けて記録する
+            result.timings["generation"] = time.perf_counter() - t - (result.timings.get("queue", 0.0) - queued)
+        return answer or None
+
+    def _answer(self, result, lang, on_text):
+        answer = self.exact_answers.get(result.question)
+        if answer is not None:
+            result.answer, result.route = answer, "exact"
+            return
+
+        hits = self.retrieve(result)
+        if result.error is not None:
+            # 埋め込みAPIの障害は「該当FAQなし」と区別して記録する
+            result.answer, result.route = SEARCH_ERROR_MESSAGE, "error"
+            return
+        if not hits:
+            result.answer, result.route = NO_MATCH_MESSAGE, "no_match"
+            return
+        top = hits[0]
+        if is_confident_hit(top, self.fast_path_lexical, self.fast_path_dense):
+            result.answer, result.route = top.answer, "fast_path"
+            return
+
+        bucket = answer_bucket(top.question, top.answer, lang, self.prompt_version)
+        cached = self.answer_cache.get(bucket, result.q_vec)
+        if cached is not None:
+            result.answer, result.route = cached, "answer_cache"
+            return
+        answer = self._generate_shared(result, bucket, top, on_text)
+        if answer is None:
+            result.answer, result.route = GENERATION_ERROR_MESSAGE, "error"
+            return
+        result.answer, result.route = answer, "generated"
+
+    def _generate_shared(self, result, bucket, top, on_text):
+        # 生成は同じ質問を待つ全セッションで共有するため、呼び出しの中ではセッション固有の
+        # on_text / on_wait を使わず、途中経過を publish して各セッションが自分で描画する。
+        # 呼び出したセッションが中断されても生成は完了し、回答キャッシュと他のセッションに届く
+        stream = on_text is not None
+
+        def call(publish):
+            upstream = TurnResult(result.question)
+            upstream.tenant = result.tenant
+            upstream.on_wait = lambda position: publish(("queue", position))
+            on_upstream_text = (lambda text: publish(("text", text))) if stream else None
+            answer = self.generate(upstream, top.question, top.answer, on_upstream_text)
+            if answer is not None:
+                self.answer_cache.put(bucket, result.q_vec, answer)
+            return answer, upstream
+
+        key = (bucket, normalize_query(result.question))
+        t = time.perf_counter()
+        (answer, upstream), shared = self.single_flight.do(
+            key, call, kind="generation", on_progress=self.progress_handler(result, on_text)
+        )
+        result.error = upstream.error
+        if shared:
+            # 先行する呼び出しを待った場合は、その回答（またはエラー）をそのまま使う
+            result.coalesced.append("generation")
+            result.timings["generation"] = time.perf_counter() - t
+        else:
+            if "queue" in upstream.timings:
+                result.timings["queue"] = result.timings.get("queue", 0.0) + upstream.timings["queue"]
+            for stage in ("ttft", "generation"):
+                if stage in upstream.timings:
+                    result.timings[stage] = upstream.timings[stage]
+            result.usage = upstream.usage
+        return answer
@@ -0,0 +1,209 @@
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+from lrad.single_flight import SingleFlight
+
+
+# --- 質問文の正規化（全角/半角の統一と空白の圧縮） ---
+def normalize_query(text):
+    text = unicodedata.normalize("NFKC", str(text))
+    return " ".join(text.split())
+
+
+# --- プロセス内の LRU キャッシュ ---
+class LruCache:
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+# --- SQLite によるディスク上のキャッシュ（TTL 付き） ---
+class SqliteVectorCache:
+    def __init__(self, path, ttl=30 * 24 * 3600, evict_every=100):
+        self.path = path
+        self.ttl = ttl
+        self.evict_every = evict_every
+        self._puts = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS query_embeddings ("
+            " model TEXT NOT NULL, query TEXT NOT NULL, vector BLOB NOT NULL, created REAL NOT NULL,"
+            " PRIMARY KEY (model, query))"
+        )
+        self._conn.commit()
+
+    def get(self, model, query):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT vector FROM query_embeddings WHERE model = ? AND query = ? AND created >= ?",
+                (model, query, time.time() - self.ttl),
+            ).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype=np.float32)
+
+    def get_many(self, model, queries, chunk_size=500):
+        found = {}
+        cutoff = time.time() - self.ttl
+        for i in range(0, len(queries), chunk_size):
+            chunk = queries[i:i + chunk_size]
+            placeholders = ",".join("?" * len(chunk))
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT query, vector FROM query_embeddings WHERE model = ? AND created >= ?"
+                    f" AND query IN ({placeholders})",
+                    (model, cutoff, *chunk),
+                ).fetchall()
+            for query, blob in rows:
+                found[query] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put(self, model, query, vector):
+        blob = np.asarray(vector, dtype=np.float32).tobytes()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO query_embeddings (model, query, vector, created) VALUES (?, ?, ?, ?)",
+                (model, query, blob, time.time()),
+            )
+            self._puts += 1
+            if self._puts % self.evict_every == 0:
+                self._evict()
+            self._conn.commit()
+
+    def put_many(self, model, items):
+        now = time.time()
+        rows = [(model, q, np.asarray(v, dtype=np.float32).tobytes(), now) for q, v in items]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO query_embeddings (model, query, vector, created) VALUES (?, ?, ?, ?)", rows
+            )
+            self._evict()
+            self._conn.commit()
+
+    def evict(self):
+        with self._lock:
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        self._conn.execute("DELETE FROM query_embeddings WHERE created < ?", (time.time() - self.ttl,))
+
+
+# --- 質問埋め込みの2段キャッシュ ---
+class QueryEmbeddingCache:
+    def __init__(self, embed_fn, model, maxsize=1024, path=".lrad_cache/query_cache.sqlite3",
+                 ttl=30 * 24 * 3600, single_flight=None):
+        self.embed_fn = embed_fn
+        self.model = model
+        # 同じ質問の同時ミスは1回の埋め込み呼び出しにまとめる
+        self.single_flight = single_flight if single_flight is not None else SingleFlight()
+        self.memory = LruCache(maxsize)
+        self.disk = SqliteVectorCache(path, ttl=ttl) if path else None
+        self._stats_lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0}
+
+    def get(self, text):
+        vec, _ = self.lookup(text)
+        return vec
+
+    def lookup(self, text, gate=None, on_progress=None):
+        # (ベクトル, "memory" | "disk" | "miss" | "coalesced") を返す
+        # gate(fn, publish) を渡すと、埋め込みAPIの呼び出しを gate 経由で行う（同時実行数の制限など）。
+        # gate 内で publish(値) を呼ぶと、同じ質問を待っている呼び出し元の on_progress(値) に通知される
+        key = normalize_query(text)
+        vec = self.memory.get(key)
+        if vec is not None:
+            self._count("memory_hits")
+            return vec, "memory"
+        if self.disk is not None:
+            vec = self.disk.get(self.model, key)
+            if vec is not None:
+                self.memory.put(key, vec)
+                self._count("disk_hits")
+                return vec, "disk"
+        vec, shared = self.single_flight.do(
+            (self.model, key), lambda publish: self._embed(key, gate, publish),
+            kind="embedding", on_progress=on_progress,
+        )
+        if shared:
+            self._count("coalesced")
+            return vec, "coalesced"
+        self._count("misses")
+        return vec, "miss"
+
+    def _embed(self, key, gate=None, publish=None):
+        # 直前に完了した同じ質問の結果があればそれを使う
+        vec = self.memory.get(key)
+        if vec is not None:
+            return vec
+        vec = self.embed_fn(key) if gate is None else gate(lambda: self.embed_fn(key), publish)
+        vec = np.asarray(vec, dtype=np.float32)
+        self.memory.put(key, vec)
+        if self.disk is not None:
+            self.disk.put(self.model, key, vec)
+        return vec
+
+    def get_many(self, texts, embed_batch_fn):
+        # 複数の質問をまとめて引き、キャッシュにないものだけを embed_batch_fn でまとめて埋め込む
+        keys = [normalize_query(t) for t in texts]
+        vectors = {}
+        for key in dict.fromkeys(keys):
+            vec = self.memory.get(key)
+            if vec is not None:
+                vectors[key] = vec
+        self._count("memory_hits", len(vectors))
+        if self.disk is not None:
+            found = self.disk.get_many(self.model, [k for k in dict.fromkeys(keys) if k not in vectors])
+            vectors.update(found)
+            self._count("disk_hits", len(found))
+        missing = [k for k in dict.fromkeys(keys) if k not in vectors]
+        if missing:
+            embedded = [np.asarray(v, dtype=np.float32) for v in embed_batch_fn(missing)]
+            vectors.update(zip(missing, embedded))
+            if self.disk is not None:
+                self.disk.put_many(self.model, zip(missing, embedded))
+            self._count("misses", len(missing))
+        if not keys:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.stack([vectors[k] for k in keys])
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        total = sum(stats.values())
+        stats["lookups"] = total
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / total if total else 0.0
+        stats["single_flight"] = self.single_flight.stats().get("embedding", {})
+        stats["memory_size"] = len(self.memory)
+        return stats
+
+    def _count(self, key, n=1):
+        with self._stats_lock:
+            self._stats[key] += n
@@ -0,0 +1,157 @@
+import threading
+from collections import Counter, OrderedDict, namedtuple
+
+import numpy as np
+
+ClusterResult = namedtuple("ClusterResult", ["n_clusters", "labels", "representatives", "sizes"])
+
+
+# --- クラスタ数の自動選択（シルエット係数） ---
+# sklearn は読み込みが重いため、クラスタリングを実行するときに読み込む
+def choose_n_clusters(vectors, weights, k_min=2, k_max=10, sample_size=1000, random_state=42):
+    from sklearn.cluster import MiniBatchKMeans
+    from sklearn.metrics import silhouette_score
+
+    n = vectors.shape[0]
+    k_max = min(k_max, n - 1)
+    if k_max < k_min:
+        return max(1, min(n, k_min))
+    rng = np.random.default_rng(random_state)
+    sample = rng.choice(n, size=min(n, sample_size), replace=False)
+    best_k, best_score = k_min, -1.0
+    for k in range(k_min, k_max + 1):
+        model = MiniBatchKMeans(n_clusters=k, random_state=random_state, n_init=3)
+        labels = model.fit_predict(vectors, sample_weight=weights)
+        if len(set(labels[sample])) < 2:
+            continue
+        score = silhouette_score(vectors[sample], labels[sample])
+        if score > best_score:
+            best_k, best_score = k, score
+    return best_k
+
+
+# --- 期間ごとの質問クラスタ（新しい質問だけで逐次更新） ---
+# 同じ質問は重複を除き、出現回数を sample_weight として扱う。
+# ベクトルは保持せず、更新のたびに embed_many（QueryEmbeddingCache.get_many）から引く。
+# seed_centers を渡すと、初回はクラスタ数の選択を省いてその重心から学習する（より広い期間の結果の流用）。
+class WindowClusters:
+    def __init__(self, start_date, end_date, seed_centers=None, random_state=42, k_max=10):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.seed_centers = seed_centers
+        self.random_state = random_state
+        self.k_max = k_max
+        self.counts = Counter()
+        self.model = None
+        self.version = None
+        self.result = None
+        self._selected_at = 0
+        self._lock = threading.Lock()
+
+    def extend(self, end_date):
+        # 終了日だけを延ばす。既存の質問はそのまま含まれるので、モデルは追加分だけで更新できる
+        with self._lock:
+            self.end_date = end_date
+            self.version = None
+
+    def centers(self):
+        # 更新中でも待たずに、直前のモデルの重心を返す
+        model = self.model
+        return None if model is None else model.cluster_centers_.copy()
+
+    def update(self, questions, version, embed_many):
+        from sklearn.cluster import MiniBatchKMeans
+
+        with self._lock:
+            if version == self.version and self.result is not None:
+                return self.result
+            counts = Counter(questions)
+            delta = counts - self.counts
+            unique = list(counts)
+            matrix = embed_many(unique) if unique else None
+            self.counts = counts
+            self.version = version
+
+            if len(unique) < 2:
+                self.result = None
+                return None
+            weights = np.array([counts[q] for q in unique], dtype=np.float64)
+
+            seed = self.seed_centers if self.model is None else None
+            if seed is not None and seed.shape[0] <= len(unique):
+                self.model = MiniBatchKMeans(n_clusters=seed.shape[0], init=seed, n_init=1,
+                                             random_state=self.random_state)
+                self.model.fit(matrix, sample_weight=weights)
+                self._selected_at = len(unique)
+            elif self.model is None or len(unique) >= 2 * self._selected_at:
+                # 初回と、質問の種類が前回選択時の2倍以上に増えたときはクラスタ数を選び直す
+                k = choose_n_clusters(matrix, weights, k_max=self.k_max, random_state=self.random_state)
+                self.model = MiniBatchKMeans(n_clusters=k, random_state=self.random_state, n_init=3)
+                self.model.fit(matrix, sample_weight=weights)
+                self._selected_at = len(unique)
+            elif delta:
+                index = {q: i for i, q in enumerate(unique)}
+                changed = list(delta)
+                self.model.partial_fit(
+                    matrix[[index[q] for q in changed]],
+                    sample_weight=np.array([delta[q] for q in changed], dtype=np.float64),
+                )
+            self.seed_centers = None
+
+            labels = self.model.predict(matrix)
+            self.result = self._summarize(unique, matrix, weights, labels)
+            return self.result
+    def _summarize(self, unique, matrix, weights, labels):
+        # 代表質問は各クラスタの重心に最も近い質問
+        centers = self.model.cluster_centers_
+        distances = np.linalg.norm(matrix - centers[labels], axis=1)
+        representatives, sizes = [], []
+        for c in range(centers.shape[0]):
+            members = np.flatnonzero(labels == c)
+            if len(members) == 0:
+                representatives.append(None)
+                sizes.append(0)
+                continue
+            representatives.append(unique[members[np.argmin(distances[members])]])
+            sizes.append(int(weights[members].sum()))
+        return ClusterResult(centers.shape[0], dict(zip(unique, labels.tolist())), representatives, sizes)
+
+
+# --- 期間ごとのクラスタを LRU で保持 ---
+# 終了日だけが延びた期間（既定の表示期間は最終日が毎日進む）は、同じ開始日のクラスタを引き継いで
+# 追加分だけで更新する。それ以外の新しい期間は、それを含むより広い期間のクラスタがあれば重心を流用する。
+class ClusterCache:
+    def __init__(self, max_windows=8):
+        self.max_windows = max_windows
+        self._windows = OrderedDict()
+        self._lock = threading.Lock()
+
+    def window(self, start_date, end_date):
+        key = (start_date, end_date)
+        with self._lock:
+            if key not in self._windows:
+                self._windows[key] = self._extend(start_date, end_date) or WindowClusters(
+                    start_date, end_date, seed_centers=self._seed(start_date, end_date)
+                )
+            self._windows.move_to_end(key)
+            while len(self._windows) > self.max_windows:
+                self._windows.popitem(last=False)
+            return self._windows[key]
+
+    def _extend(self, start_date, end_date):
+        # 同じ開始日で終了日が手前の期間のうち、最も長いものを引き継ぐ
+        earlier = [k for k in self._windows if k[0] == start_date and k[1] < end_date]
+        if not earlier:
+            return None
+        clusters = self._windows.pop(max(earlier, key=lambda k: k[1]))
+        clusters.extend(end_date)
+        return clusters
+
+    def _seed(self, start_date, end_date):
+        # 期間を含む最も狭い期間の重心
+        wider = [k for k in self._windows if k[0] <= start_date and k[1] >= end_date]
+        for k in sorted(wider, key=lambda k: k[1] - k[0]):
+            centers = self._windows[k].centers()
+            if centers is not None:
+                return centers
+        return None
@@ -0,0 +1,78 @@
+import sys
+
+import numpy as np
+import pandas as pd
+
+from lrad.lexical import Bm25Index, compact_text
+
+
+# --- 語彙検索（BM25）と密ベクトル検索の融合 ---
+class HybridRetriever:
+    def __init__(self, index, lexical=None, alpha=0.7):
+        self.index = index
+        self.lexical = lexical if lexical is not None else Bm25Index(index.questions)
+        self.alpha = alpha
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def nbytes(self):
+        return self.index.nbytes + self.lexical.nbytes
+
+    def search(self, query, q_vec, k=1, min_score=None):
+        # min_score は密ベクトルのコサイン類似度に対するしきい値
+        if len(self.index) == 0:
+            return []
+        dense = self.index.scores(q_vec)
+        # 語彙スコアは候補中の最大値ではなくクエリ自身のスコアで割る（弱い一致は弱いまま）
+        lexical = self.lexical.scores(query)
+        ceiling = self.lexical.self_score(query)
+        if ceiling > 0:
+            lexical = np.minimum(lexical / ceiling, 1.0)
+        fused = self.alpha * dense + (1 - self.alpha) * lexical
+
+        k = min(k, len(fused))
+        top = np.argpartition(-fused, k - 1)[:k]
+        top = top[np.argsort(-fused[top])]
+        hits = []
+        for i in top:
+            i = int(i)
+            if min_score is not None and dense[i] < min_score:
+                continue
+            hits.append(self.index.hit(i, float(fused[i]))._replace(
+                dense=float(dense[i]), lexical=self.lexical.overlap(query, i)))
+        return hits
+
+
+# --- LLM を使わない直接回答 ---
+def is_confident_hit(hit, lexical_threshold, dense_threshold):
+    return hit.lexical is not None and hit.lexical >= lexical_threshold and hit.dense >= dense_threshold
+
+
+class ExactAnswerTable:
+    def __init__(self, pairs=()):
+        self._answers = {}
+        for question, answer in pairs:
+            self.add(question, answer)
+
+    def add(self, question, answer):
+        key = compact_text(question)
+        if key and isinstance(answer, str) and answer.strip():
+            self._answers.setdefault(key, answer)
+
+    def add_csv(self, path):
+        # よくある質問CSV（カテゴリ, 質問, 回答）の2・3列目を登録する
+        df = pd.read_csv(path)
+        for question, answer in zip(df.iloc[:, 1], df.iloc[:, 2]):
+            self.add(str(question), answer)
+
+    def get(self, question):
+        return self._answers.get(compact_text(question))
+
+    def __len__(self):
+        return len(self._answers)
+
+    @property
+    def nbytes(self):
+        return sys.getsizeof(self._answers) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in self._answers.items())
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import uuid
+
+import pandas as pd
+
+
+def sheet_values(df):
+    # Sheets に送れる値（日時は文字列、欠損は空欄）に変換する
+    df = df.copy()
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = df[col].dt.strftime("%Y-%m-%d %H:%M:%S")
+    df = df.astype(object).where(df.notna(), "")
+    return [[v if isinstance(v, (str, int, float)) else str(v) for v in row] for row in df.values.tolist()]
+
+
+# --- Google Sheets への差分エクスポート ---
+# シートごとに「同期済みの期間・最後のタイムスタンプとその件数・行数・列」を保存しておき、
+# 次回はそれより新しい行だけを分割して追記する。期間が前回の終わりを延ばしただけでない場合
+# （開始日の変更や期間の縮小・移動）、列が変わった場合、シート側の行数や見出しが記録と合わない
+# 場合は、全体を分割して書き直す。
+class SheetExporter:
+    def __init__(self, spreadsheet, state_dir=".lrad_cache/sheet_sync", chunk_rows=500, state_key=""):
+        # spreadsheet: gspread の Spreadsheet（または同じメソッドを持つ代替実装）
+        self.spreadsheet = spreadsheet
+        self.state_dir = state_dir
+        self.chunk_rows = chunk_rows
+        self.state_key = state_key
+
+    def sync(self, data, sheet_name, timestamp_col="timestamp", window=None):
+        # {"mode": "append" | "rewrite" | "noop", "rows": 送った行数, "requests": 書き込み回数} を返す
+        # window: data を絞り込んだ期間 (開始日, 終了日)。省略時は data の最初と最後の日付
+        data = data.sort_values(timestamp_col, kind="stable").reset_index(drop=True)
+        columns = [str(c) for c in data.columns]
+        if window is None:
+            ts = data[timestamp_col]
+            window = (ts.iloc[0].date(), ts.iloc[-1].date()) if len(ts) else (None, None)
+        window = [None if w is None else str(w) for w in window]
+        state = self._load_state(sheet_name)
+        worksheet = self._worksheet(sheet_name, len(columns))
+
+        reason = self._rewrite_reason(state, columns, window, worksheet)
+        if reason is None:
+            new_rows = self._new_rows(state, data, timestamp_col)
+            if new_rows.empty:
+                return {"mode": "noop", "rows": 0, "requests": 0}
+            requests = self._append(worksheet, sheet_values(new_rows))
+            rows = state["rows"] + len(new_rows)
+            result = {"mode": "append", "rows": len(new_rows), "requests": requests}
+        else:
+            worksheet.clear()
+            if worksheet.col_count < len(columns):
+                worksheet.resize(cols=len(columns))
+            requests = 1 + self._append(worksheet, [columns] + sheet_values(data))
+            rows = len(data)
+            result = {"mode": "rewrite", "rows": len(data), "requests": requests, "reason": reason}
+
+        last = data[timestamp_col].iloc[-1] if len(data) else None
+        self._save_state(sheet_name, {
+            "columns": columns,
+            "rows": rows,
+            "window": window,
+            "last_timestamp": None if last is None else str(last),
+            "rows_at_last": 0 if last is None else int((data[timestamp_col] == last).sum()),
+        })
+        return result
+
+    def _rewrite_reason(self, state, columns, window, worksheet):
+        if state is None or "window" not in state:
+            return "初回"
+        if state["columns"] != columns:
+            return "列の変更"
+        # 同じ開始日で終了日が同じか後ろに延びた場合だけ、前回の行をそのまま残せる
+        start, end = state["window"]
+        if window[0] != start or end is None or window[1] is None or window[1] < end:
+            return "期間の変更"
+        # 他の端末での書き込みや手作業の編集に備えて、見出しと行数だけ確認する
+        filled = worksheet.col_values(1)
+        if worksheet.row_values(1) != columns or len(filled) != state["rows"] + 1:
+            return "シートの内容が記録と不一致"
+        return None
+
+    def _new_rows(self, state, data, timestamp_col):
+        # 最後のタイムスタンプと同時刻の行は、同期済みの件数を除いた分だけ送る
+        if state["last_timestamp"] is None:
+            return data
+        last = pd.Timestamp(state["last_timestamp"])
+        ts = data[timestamp_col]
+        same = data[ts == last].iloc[state["rows_at_last"]:]
+        return pd.concat([same, data[ts > last]])
+
+    def _append(self, worksheet, values):
+        requests = 0
+        for start in range(0, len(values), self.chunk_rows):
+            worksheet.append_rows(values[start:start + self.chunk_rows], value_input_option="USER_ENTERED")
+            requests += 1
+        return requests
+
+    def _worksheet(self, sheet_name, n_cols):
+        import gspread
+
+        try:
+            return self.spreadsheet.worksheet(sheet_name)
+        except gspread.WorksheetNotFound:
+            return self.spreadsheet.add_worksheet(title=sheet_name, rows="1000", cols=str(max(20, n_cols)))
+
+    # --- 同期状態の保存 ---
+    def _state_path(self, sheet_name):
+        key = hashlib.sha256(f"{self.state_key}\n{sheet_name}".encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.state_dir, f"{key}.json")
+
+    def _load_state(self, sheet_name):
+        try:
+            with open(self._state_path(sheet_name), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_state(self, sheet_name, state):
+        os.makedirs(self.state_dir, exist_ok=True)
+        path = self._state_path(sheet_name)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp, path)
@@ -0,0 +1,115 @@
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.finished = False
+        self.abandoned = False
+        self.value = None
+        self.error = None
+        self.progress = None
+        self.updates = 0
+        self.waiters = 0
+
+    def publish(self, value):
+        with self.cond:
+            self.progress = value
+            self.updates += 1
+            self.cond.notify_all()
+
+
+# --- 同じキーの同時実行をまとめる（single-flight） ---
+# 実行中のキーに対する呼び出しは、先行する1回の結果（または例外）を待って共有する。
+# 完了後の呼び出しは新たに実行する（結果の保持はキャッシュ側の役割）。
+# 先行する呼び出しが Exception 以外（画面の再実行による中断など）で終わった場合、
+# その例外は共有せず、待っていた呼び出しのうち1つが改めて実行する。
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {}
+
+    def do(self, key, fn, kind="default", on_progress=None):
+        # (値, 他の呼び出しの結果を共有したか) を返す
+        # fn(publish) の中で publish(値) を呼ぶと、待っている全ての呼び出し元に途中経過を通知できる。
+        # on_progress を渡すと fn は別スレッドで実行し、途中経過は呼び出し元ごとに自分のスレッドで
+        # on_progress(値) として受け取る。呼び出し元固有の処理（画面描画など）は共有する処理の中で動かず、
+        # on_progress で中断されても fn は完了まで実行されて他の呼び出し元に結果が届く。
+        with self._lock:
+            self._count(kind, "calls")
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                    self._count(kind, "executed")
+                else:
+                    call.waiters += 1
+            if leader and on_progress is None:
+                return self._run(key, call, fn, kind), False
+            if leader:
+                threading.Thread(target=self._run_detached, args=(key, call, fn, kind), daemon=True).start()
+            self._wait(call, on_progress)
+            if call.abandoned:
+                # 先行する呼び出しが中断された。改めて実行する（または新しい先行呼び出しを待つ）
+                continue
+            if call.error is not None:
+                raise call.error
+            if not leader:
+                with self._lock:
+                    self._count(kind, "coalesced")
+            return call.value, not leader
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self):
+        # kind ごとの {"calls", "executed", "coalesced", "abandoned"}
+        with self._lock:
+            return {kind: dict(counts) for kind, counts in self._stats.items()}
+
+    def _run(self, key, call, fn, kind):
+        try:
+            call.value = fn(call.publish)
+            return call.value
+        except Exception as e:
+            call.error = e
+            raise
+        except BaseException:
+            call.abandoned = True
+            with self._lock:
+                self._count(kind, "abandoned")
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            with call.cond:
+                call.finished = True
+                call.cond.notify_all()
+
+    def _run_detached(self, key, call, fn, kind):
+        # 結果と例外は call に残し、呼び出し元がそれぞれ受け取る
+        try:
+            self._run(key, call, fn, kind)
+        except BaseException:
+            pass
+
+    @staticmethod
+    def _wait(call, on_progress):
+        seen = 0
+        while True:
+            with call.cond:
+                while not call.finished and call.updates == seen:
+                    call.cond.wait()
+                if call.finished:
+                    return
+                progress, seen = call.progress, call.updates
+            if on_progress is not None:
+                on_progress(progress)
+
+    def _count(self, kind, key):
+        counts = self._stats.setdefault(kind, {"calls": 0, "executed": 0, "coalesced": 0, "abandoned": 0})
+        counts[key] += 1
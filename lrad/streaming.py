@@ -0,0 +1,31 @@
+import time
+from collections import namedtuple
+
+StreamResult = namedtuple("StreamResult", ["text", "ttft", "total", "usage"], defaults=(None,))
+
+
+# --- チャット回答のストリーミング ---
+# 受信したトークンを on_text(これまでの全文) で通知し、完了後に全文と計測値を返す。
+# ttft は最初のトークンまでの秒数、total は生成完了までの秒数、usage は最終チャンクのトークン数。
+def stream_chat_completion(client, on_text=None, min_interval=0.05, **kwargs):
+    started = time.perf_counter()
+    ttft = None
+    usage = None
+    parts = []
+    last_render = 0.0
+    stream = client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **kwargs)
+    for chunk in stream:
+        if getattr(chunk, "usage", None) is not None:
+            usage = chunk.usage
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if not delta:
+            continue
+        now = time.perf_counter()
+        if ttft is None:
+            ttft = now - started
+        parts.append(delta)
+        # 描画回数を抑えるため一定間隔ごとに通知する
+        if on_text is not None and now - last_render >= min_interval:
+            on_text("".join(parts))
+            last_render = now
+    return StreamResult("".join(parts).strip(), ttft, time.perf_counter() - started, usage)
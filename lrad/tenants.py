@@ -0,0 +1,85 @@
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+TenantCorpus = namedtuple("TenantCorpus", ["path", "version", "retriever", "exact_answers", "nbytes"])
+
+
+def tenant_faq_path(tenant, tenant_dir="faq_tenants", default="faq_all.csv"):
+    # テナント専用の FAQ（<tenant_dir>/<tenant>.csv）が無ければ共通の FAQ を使う
+    if tenant:
+        path = os.path.join(tenant_dir, f"{tenant}.csv")
+        if os.path.exists(path):
+            return path
+    return default
+
+
+class _Entry:
+    def __init__(self, store):
+        self.store = store
+        self.corpus = None
+
+
+# --- テナント別 FAQ コーパスのプロセス内共有 ---
+# コーパス（FAQ CSV）ごとに埋め込みストアと検索インデックスを初回利用時に読み込み、
+# 同じコーパスを使う全セッションで共有する。合計サイズが memory_budget を超えたら
+# 最近使われていないものから解放する（埋め込みはディスクに残るので再読み込みは速い）。
+class CorpusRegistry:
+    def __init__(self, open_store, build_corpus, memory_budget=512 * 2**20):
+        # open_store(path) -> FaqEmbeddingStore
+        # build_corpus(snapshot) -> (retriever, exact_answers)
+        self.open_store = open_store
+        self.build_corpus = build_corpus
+        self.memory_budget = memory_budget
+        self._entries = OrderedDict()
+        self._path_locks = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "loads": 0, "rebuilds": 0, "evictions": 0}
+
+    def get(self, path):
+        with self._path_lock(path):
+            with self._lock:
+                entry = self._entries.get(path)
+            if entry is None:
+                entry = _Entry(self.open_store(path))
+                self._count("loads")
+            snapshot = entry.store.snapshot()
+            if entry.corpus is None or entry.corpus.version != snapshot.version:
+                if entry.corpus is not None:
+                    self._count("rebuilds")
+                retriever, exact_answers = self.build_corpus(snapshot)
+                entry.corpus = TenantCorpus(
+                    path, snapshot.version, retriever, exact_answers, retriever.nbytes + exact_answers.nbytes
+                )
+            else:
+                self._count("hits")
+            with self._lock:
+                self._entries[path] = entry
+                self._entries.move_to_end(path)
+                self._evict()
+            return entry.corpus
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["corpora"] = list(self._entries)
+            stats["bytes"] = self._total_bytes()
+            stats["memory_budget"] = self.memory_budget
+        return stats
+
+    def _evict(self):
+        # 直前に使ったコーパス（末尾）は予算を超えていても残す
+        while len(self._entries) > 1 and self._total_bytes() > self.memory_budget:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _total_bytes(self):
+        return sum(e.corpus.nbytes for e in self._entries.values() if e.corpus is not None)
+
+    def _path_lock(self, path):
+        with self._lock:
+            return self._path_locks.setdefault(path, threading.Lock())
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1